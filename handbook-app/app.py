@@ -1,57 +1,156 @@
 import gradio as gr
+import hashlib
+import importlib
 import os
+import re
+import threading
+import time
+import uuid
 from dotenv import load_dotenv
-from pdf_processor import PDFProcessor
+import metrics
+from session_manager import SessionManager
+from ingest_scheduler import IngestScheduler
 from handbook_generator import HandbookGenerator
+from handbook_jobs import HandbookJobManager, has_unfinished_jobs
 import json
 
-# Load environment variables
-load_dotenv()
+# Seconds between progress checks while the chat follows a handbook job
+JOB_POLL_SECONDS = 1.0
 
-# Initialize components
-pdf_processor = PDFProcessor()
-handbook_generator = HandbookGenerator()
+# Browser IDs are random and unguessable; anything else from the browser is ignored
+_CLIENT_ID_RE = re.compile(r'[0-9a-f]{32}')
 
-# Global state to store processed documents
-processed_docs = []
 
+class _Lazy:
+    def __init__(self, name, factory):
+        """A component built by ``factory`` on first use, once, even under concurrent requests"""
+        self.name = name
+        self.factory = factory
+        self.value = None
+        self._lock = threading.Lock()
 
-def upload_pdf(files):
-    """Process uploaded PDF files"""
-    global processed_docs
+    def get(self):
+        if self.value is None:
+            with self._lock:
+                if self.value is None:
+                    with metrics.span('init', component=self.name):
+                        self.value = self.factory()
+        return self.value
+
+
+# Components are built on first use (or by the warm-up thread) so the UI is
+# served without waiting for the vector store, embedding model or LLM client.
+# Each browser session gets its own documents.
+sessions = _Lazy('sessions', SessionManager)
+handbook_generator = _Lazy('handbook_generator', HandbookGenerator)
+# Background handbook generation, resuming any jobs left unfinished by a restart
+handbook_jobs = _Lazy('handbook_jobs', lambda: HandbookJobManager(
+    handbook_generator.get(), sessions.get().shared.select_context, save=save_handbook,
+    load_previous=load_handbook_sections, select_contexts=sessions.get().shared.select_contexts,
+    find_session=sessions.get().find))
+
+
+def warm_up():
+    """Build every component and load the embedding model ahead of the first request"""
+    try:
+        with metrics.span('warm_up'):
+            handbook_jobs.get()
+            sessions.get().shared.processor.embedding_function(["warm up"])
+            # PDF libraries are otherwise imported by the first upload
+            for module in ('pdfplumber', 'PyPDF2'):
+                importlib.import_module(module)
+        print("🔥 Warm-up complete")
+    except Exception as e:
+        print(f"Warm-up failed, components will load on first use: {e}")
+
+
+def resume_jobs():
+    """Build the job manager at launch if a previous run left jobs unfinished, so they resume without waiting for a request"""
+    try:
+        if has_unfinished_jobs():
+            handbook_jobs.get()
+    except Exception as e:
+        print(f"Could not resume handbook jobs, they will resume on first use: {e}")
+
+
+def session_key(request: gr.Request, client_id=None):
+    """Durable identity for the caller's session.
+
+    The logged-in user when auth is on, otherwise the random ID this browser
+    keeps in local storage, so a session survives page reloads and restarts.
+    Gradio's session hash, which changes on every page load, is the last resort.
+    """
+    username = getattr(request, 'username', None)
+    if username:
+        return "user_" + hashlib.sha256(username.encode('utf-8')).hexdigest()[:32]
+    if client_id and _CLIENT_ID_RE.fullmatch(client_id):
+        return f"browser_{client_id}"
+    return getattr(request, 'session_hash', None)
+
+
+def new_client_id(client_id):
+    """This browser's ID, created on its first visit (an ID that is not ours is replaced)"""
+    if client_id and _CLIENT_ID_RE.fullmatch(client_id):
+        return client_id
+    return uuid.uuid4().hex
+
+
+def _session(request: gr.Request, client_id=None):
+    """The caller's session (shared when isolation is off or the caller cannot be identified)"""
+    return sessions.get().get(session_key(request, client_id))
+
+
+def upload_pdf(files, client_id, request: gr.Request):
+    """Process uploaded PDF files, reporting each file as it completes"""
+    session = _session(request, client_id)
+    processed_docs = session.processed_docs
 
     if not files:
-        return "No files uploaded.", ""
+        yield "No files uploaded.", ""
+        return
+
+    results = [f"⏳ Processing {len(files)} file(s)..."]
+    yield "\n".join(results), _format_docs_list(processed_docs)
+
+    with session.busy(), metrics.span('upload_pdf') as fields:
+        upload_bytes = sum(os.path.getsize(file.name) for file in files)
+        metrics.inc('upload_bytes_total', upload_bytes)
+        fields.update(files=len(files), bytes=upload_bytes)
 
-    results = []
-    for file in files:
-        try:
-            # Extract text from PDF
-            text = pdf_processor.extract_text_from_pdf(file.name)
+        # Files are extracted concurrently and their chunks embedded in shared batches;
+        # content already ingested is skipped
+        for result in IngestScheduler(session.processor).run([file.name for file in files]):
+            filename = os.path.basename(result['path'])
+            metrics.inc('upload_files_total', status=result['status'])
 
-            # Store in vector database
-            pdf_processor.add_to_vectordb(text, file.name)
+            if result['status'] == 'error':
+                results.append(f"✗ Error with {filename}: {result['error']}")
+            else:
+                if not any(doc['filename'] == filename for doc in processed_docs):
+                    processed_docs.append({
+                        'filename': filename,
+                        'text': result['preview'] + "..." if result['chars'] > len(result['preview']) else result['preview']
+                    })
 
-            processed_docs.append({
-                'filename': os.path.basename(file.name),
-                'text': text[:500] + "..." if len(text) > 500 else text
-            })
+                if result['status'] == 'cached':
+                    results.append(f"✓ Already indexed: {filename} ({result['chars']} characters)")
+                else:
+                    results.append(f"✓ Processed: {filename} ({result['chars']} characters)")
 
-            results.append(f"✓ Processed: {os.path.basename(file.name)} ({len(text)} characters)")
-        except Exception as e:
-            results.append(f"✗ Error with {os.path.basename(file.name)}: {str(e)}")
+            yield "\n".join(results), _format_docs_list(processed_docs)
 
-    summary = "\n".join(results)
-    docs_list = "\n\n".join([f"**{doc['filename']}**\n{doc['text']}" for doc in processed_docs])
 
-    return summary, docs_list
+def _format_docs_list(processed_docs):
+    """Render the processed documents panel"""
+    return "\n\n".join([f"**{doc['filename']}**\n{doc['text']}" for doc in processed_docs])
 
 
-def chat_with_context(message, history):
+def chat_with_context(message, history, client_id, request: gr.Request):
     """Chat with context from uploaded PDFs"""
     if not message:
         return history
 
+    session = _session(request, client_id)
     try:
         # Check if user is requesting handbook generation
         if any(keyword in message.lower() for keyword in
@@ -59,27 +158,22 @@ def chat_with_context(message, history):
             # Extract topic from message
             topic = extract_topic(message)
 
-            # Get relevant context
-            context = pdf_processor.get_relevant_context(topic, k=10)
-
-            yield history + [{"role": "user", "content": message}, {"role": "assistant", "content": "🔄 Generating your handbook... This may take 2-3 minutes for 20,000+ words..."}]
-
-            handbook = handbook_generator.generate_handbook(topic, context)
-
-            # Save to file
-            filename = save_handbook(handbook, topic)
+            # Generated as a background job, which carries on if this page is closed;
+            # meanwhile the chat follows it, showing sections as they finish
+            job_id = handbook_jobs.get().submit(topic, session.select_context, owner=session.session_id,
+                                                corpus=session.iter_chunks, select_contexts=session.select_contexts)
 
-            response = f"✅ **Handbook Generated!**\n\nI've created a comprehensive handbook on '{topic}' with {len(handbook.split())} words.\n\n**Preview:**\n{handbook[:1000]}...\n\n[Full handbook saved to: {filename}]"
-
-            yield history + [{"role": "user", "content": message}, {"role": "assistant", "content": response}]
+            for response in follow_job(job_id, topic):
+                yield history + [{"role": "user", "content": message}, {"role": "assistant", "content": response}]
         else:
             # Regular chat - get relevant context and respond
-            context = pdf_processor.get_relevant_context(message, k=3)
+            with session.busy():
+                context = session.processor.get_relevant_context(message, k=3)
 
-            if not context:
-                response = "I don't have any relevant information from the uploaded PDFs. Please upload some documents first!"
-            else:
-                response = handbook_generator.generate_response(message, context)
+                if not context:
+                    response = "I don't have any relevant information from the uploaded PDFs. Please upload some documents first!"
+                else:
+                    response = handbook_generator.get().generate_response(message, context)
 
             yield history + [{"role": "user", "content": message}, {"role": "assistant", "content": response}]
 
@@ -88,6 +182,36 @@ def chat_with_context(message, history):
         yield history + [{"role": "user", "content": message}, {"role": "assistant", "content": error_msg}]
 
 
+def follow_job(job_id, topic):
+    """Yield chat messages tracking a handbook job: the handbook so far while it runs, then the result"""
+    jobs = handbook_jobs.get()
+    queued = f"🔄 **Handbook queued** (job `{job_id}`)\n\nGenerating a comprehensive handbook on '{topic}'. This may take 2-3 minutes for 20,000+ words..."
+    yield queued
+
+    last = None
+    while True:
+        job = jobs.status(job_id)
+        if job is None or job['status'] not in ('queued', 'running'):
+            break
+
+        if job['status'] == 'running' and job['sections_done']:
+            handbook = jobs.handbook(job_id)
+            if handbook != last:
+                last = handbook
+                yield (f"🔄 Generating your handbook... ({job['sections_done']}/{job['total_sections']} sections done, "
+                       f"job `{job_id}`)\n\n{handbook}")
+        time.sleep(JOB_POLL_SECONDS)
+
+    if job is None or job['status'] == 'error':
+        error = job['error'] if job else "job record not found"
+        yield f"❌ Handbook job `{job_id}` failed: {error}\n\nUse Resume Job in the Handbook Jobs panel to retry the unfinished sections."
+        return
+
+    handbook = jobs.handbook(job_id) or ""
+    yield (f"✅ **Handbook Generated!**\n\nI've created a comprehensive handbook on '{topic}' with {len(handbook.split())} words.\n\n"
+           f"**Preview:**\n{handbook[:1000]}...\n\n[Full handbook saved to: {job['filename']}]")
+
+
 def extract_topic(message):
     """Extract the main topic from user message"""
     lower_msg = message.lower()
@@ -105,133 +229,266 @@ def extract_topic(message):
     return topic[:100]
 
 
-def save_handbook(handbook_text, topic):
-    """Save handbook to a file"""
-    os.makedirs("handbooks", exist_ok=True)
-
+def handbook_path(topic, owner=None):
+    """Where the handbook for a topic is saved; each session's handbooks go in their own folder"""
     safe_topic = "".join(c for c in topic if c.isalnum() or c in (' ', '-', '_')).strip()
     safe_topic = safe_topic.replace(" ", "_")[:50]
 
-    filename = f"handbooks/{safe_topic}_handbook.md"
+    if owner and owner != 'shared':
+        safe_owner = "".join(c for c in owner if c.isalnum() or c in ('-', '_'))[:48] or "anonymous"
+        return f"handbooks/{safe_owner}/{safe_topic}_handbook.md"
+    return f"handbooks/{safe_topic}_handbook.md"
 
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write(handbook_text)
 
+def _sections_path(filename):
+    """Sidecar next to a saved handbook recording each section's text and context fingerprint"""
+    return os.path.splitext(filename)[0] + ".sections.json"
+
+
+def save_handbook(handbook_text, topic, sections=None, owner=None):
+    """Save handbook to a file, with its sections alongside for incremental regeneration"""
+    filename = handbook_path(topic, owner)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+    with metrics.span('save_handbook') as fields:
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(handbook_text)
+        size = len(handbook_text.encode('utf-8'))
+        fields.update(bytes=size, words=len(handbook_text.split()))
+
+        if sections:
+            with open(_sections_path(filename), 'w', encoding='utf-8') as f:
+                json.dump({'topic': topic, 'sections': sections}, f)
+
+    metrics.inc('saved_bytes_total', size)
     return filename
 
 
-def clear_database():
-    """Clear all processed documents and reset database"""
-    global processed_docs
-    processed_docs = []
-    pdf_processor.clear_vectordb()
+def load_handbook_sections(topic, owner=None):
+    """Sections of the owner's last saved handbook on a topic, if any"""
+    path = _sections_path(handbook_path(topic, owner))
+    if not os.path.exists(path):
+        return {}
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)['sections']
+    except Exception as e:
+        print(f"Could not load previous sections from {path}: {e}")
+        return {}
+
+
+def format_jobs(client_id, request: gr.Request):
+    """Render the handbook jobs panel with the caller's jobs"""
+    # Polled every few seconds; no jobs can exist before the job manager is built
+    if handbook_jobs.value is None:
+        return "No handbook jobs yet."
+
+    jobs = handbook_jobs.value.list_jobs(owner=_session(request, client_id).session_id)[:10]
+    if not jobs:
+        return "No handbook jobs yet."
+
+    rows = ["| Job | Topic | Status | Sections | Saved to |", "|---|---|---|---|---|"]
+    for job in jobs:
+        status = f"❌ {job['error'][:60]}" if job['status'] == 'error' else job['status']
+        rows.append(f"| `{job['job_id']}` | {job['topic']} | {status} | "
+                    f"{job['sections_done']}/{job['total_sections']} | {job['filename'] or ''} |")
+    return "\n".join(rows)
+
+
+def show_job(job_id, client_id, request: gr.Request):
+    """Show one of the caller's jobs' handbook: live progress while running, the saved file once done"""
+    job_id = (job_id or "").strip()
+    handbook = handbook_jobs.get().handbook(job_id, owner=_session(request, client_id).session_id) if job_id else None
+    return handbook if handbook is not None else f"No handbook job `{job_id}`."
+
+
+def resume_job(job_id, client_id, request: gr.Request):
+    """Requeue one of the caller's finished or failed jobs; sections already generated are reused"""
+    job_id = (job_id or "").strip()
+    if handbook_jobs.get().resume(job_id, owner=_session(request, client_id).session_id):
+        return f"↺ Job `{job_id}` requeued."
+    return f"Job `{job_id}` is unknown or still in progress."
+
+
+def clear_database(client_id, request: gr.Request):
+    """Clear this session's processed documents and reset its database"""
+    session = _session(request, client_id)
+    with session.busy():
+        session.processed_docs.clear()
+        session.processor.clear_vectordb()
     return "Database cleared!", ""
 
 
-# Create Gradio interface
-# FIX: theme moved to launch() to avoid Gradio 6 deprecation warning
-with gr.Blocks(title="AI Handbook Generator") as demo:
-    gr.Markdown("""
-    # 📚 AI Handbook Generator
-
-    Upload PDFs, chat about them, and generate comprehensive 20,000+ word handbooks!
-
-    ## How to use:
-    1. **Upload PDFs** - Add research papers, documentation, or any text-based PDFs
-    2. **Chat** - Ask questions about the uploaded content
-    3. **Generate Handbook** - Request a comprehensive handbook on any topic from your documents
-
-    ### Example prompts for handbook generation:
-    - "Create a handbook on Retrieval-Augmented Generation"
-    - "Generate a comprehensive guide about AI safety"
-    - "Write a handbook on machine learning techniques"
-    """)
-
-    with gr.Row():
-        with gr.Column(scale=1):
-            gr.Markdown("### 📁 Document Upload")
-            file_upload = gr.File(
-                label="Upload PDF Files",
-                file_count="multiple",
-                file_types=[".pdf"]
-            )
-            upload_btn = gr.Button("Process PDFs", variant="primary")
-            clear_btn = gr.Button("Clear Database", variant="stop")
-
-            upload_status = gr.Textbox(
-                label="Upload Status",
-                lines=5,
-                interactive=False
-            )
-
-            docs_display = gr.Markdown(
-                label="Processed Documents",
-                value="No documents uploaded yet."
-            )
-
-        with gr.Column(scale=2):
-            gr.Markdown("### 💬 Chat & Generate")
-            chatbot = gr.Chatbot(
-                height=500,
-                label="Conversation",
-            )
-            msg = gr.Textbox(
-                label="Your Message",
-                placeholder="Ask a question or request 'Create a handbook on [topic]'...",
-                lines=2
-            )
-
-            with gr.Row():
-                send_btn = gr.Button("Send", variant="primary")
-                clear_chat = gr.Button("Clear Chat")
-
-    gr.Markdown("""
-    ---
-    ### 💡 Tips:
-    - Upload multiple related PDFs for richer handbooks
-    - The more context provided, the better the handbook quality
-    - Handbook generation takes 2-3 minutes for 20,000+ words
-    - All handbooks are saved in the `handbooks/` folder
-    """)
-
-    # Event handlers
-    upload_btn.click(
-        upload_pdf,
-        inputs=[file_upload],
-        outputs=[upload_status, docs_display]
-    )
-
-    msg.submit(
-        chat_with_context,
-        inputs=[msg, chatbot],
-        outputs=[chatbot]
-    ).then(
-        lambda: "",
-        outputs=[msg]
-    )
-
-    send_btn.click(
-        chat_with_context,
-        inputs=[msg, chatbot],
-        outputs=[chatbot]
-    ).then(
-        lambda: "",
-        outputs=[msg]
-    )
-
-    clear_chat.click(
-        lambda: None,
-        outputs=[chatbot]
-    )
-
-    clear_btn.click(
-        clear_database,
-        outputs=[upload_status, docs_display]
-    )
+def build_ui():
+    """Build the Gradio interface.
+
+    Called only when the app is launched: PDF extraction workers are spawned
+    and re-import this module, and must not each build the UI.
+    """
+    # Create Gradio interface
+    # FIX: theme moved to launch() to avoid Gradio 6 deprecation warning
+    with gr.Blocks(title="AI Handbook Generator") as demo:
+        gr.Markdown("""
+        # 📚 AI Handbook Generator
+
+        Upload PDFs, chat about them, and generate comprehensive 20,000+ word handbooks!
+
+        ## How to use:
+        1. **Upload PDFs** - Add research papers, documentation, or any text-based PDFs
+        2. **Chat** - Ask questions about the uploaded content
+        3. **Generate Handbook** - Request a comprehensive handbook on any topic from your documents
+
+        ### Example prompts for handbook generation:
+        - "Create a handbook on Retrieval-Augmented Generation"
+        - "Generate a comprehensive guide about AI safety"
+        - "Write a handbook on machine learning techniques"
+        """)
+
+        with gr.Row():
+            with gr.Column(scale=1):
+                gr.Markdown("### 📁 Document Upload")
+                file_upload = gr.File(
+                    label="Upload PDF Files",
+                    file_count="multiple",
+                    file_types=[".pdf"]
+                )
+                upload_btn = gr.Button("Process PDFs", variant="primary")
+                clear_btn = gr.Button("Clear Database", variant="stop")
+
+                upload_status = gr.Textbox(
+                    label="Upload Status",
+                    lines=5,
+                    interactive=False
+                )
+
+                docs_display = gr.Markdown(
+                    label="Processed Documents",
+                    value="No documents uploaded yet."
+                )
+
+            with gr.Column(scale=2):
+                gr.Markdown("### 💬 Chat & Generate")
+                chatbot = gr.Chatbot(
+                    height=500,
+                    label="Conversation",
+                )
+                msg = gr.Textbox(
+                    label="Your Message",
+                    placeholder="Ask a question or request 'Create a handbook on [topic]'...",
+                    lines=2
+                )
+
+                with gr.Row():
+                    send_btn = gr.Button("Send", variant="primary")
+                    clear_chat = gr.Button("Clear Chat")
+
+        with gr.Row():
+            with gr.Column():
+                gr.Markdown("### 📋 Handbook Jobs")
+                jobs_display = gr.Markdown(value="No handbook jobs yet.")
+                jobs_timer = gr.Timer(2)
+
+                with gr.Row():
+                    job_id_box = gr.Textbox(label="Job ID", placeholder="Paste a job ID", scale=3)
+                    show_job_btn = gr.Button("Show Handbook", scale=1)
+                    resume_job_btn = gr.Button("Resume Job", scale=1)
+
+                job_handbook = gr.Markdown()
+
+        gr.Markdown("""
+        ---
+        ### 💡 Tips:
+        - Upload multiple related PDFs for richer handbooks
+        - The more context provided, the better the handbook quality
+        - Handbooks generate in the background (20,000+ words in total) and appear in the chat as sections finish; closing the page does not stop them, and the Handbook Jobs panel shows your jobs by ID
+        - Interrupted jobs resume from their last finished section after a restart
+        - All handbooks are saved in the `handbooks/` folder
+        """)
+
+        # Identifies this browser's session across reloads and restarts
+        client_id = gr.BrowserState(None, storage_key="handbook_client_id")
+
+        # Event handlers
+        demo.load(
+            new_client_id,
+            inputs=[client_id],
+            outputs=[client_id]
+        )
+
+        upload_btn.click(
+            upload_pdf,
+            inputs=[file_upload, client_id],
+            outputs=[upload_status, docs_display]
+        )
+
+        msg.submit(
+            chat_with_context,
+            inputs=[msg, chatbot, client_id],
+            outputs=[chatbot],
+            # Followers of handbook jobs mostly sleep; generation itself is bounded by the job pool
+            concurrency_limit=None
+        ).then(
+            lambda: "",
+            outputs=[msg]
+        )
+
+        send_btn.click(
+            chat_with_context,
+            inputs=[msg, chatbot, client_id],
+            outputs=[chatbot],
+            concurrency_limit=None
+        ).then(
+            lambda: "",
+            outputs=[msg]
+        )
+
+        clear_chat.click(
+            lambda: None,
+            outputs=[chatbot]
+        )
+
+        jobs_timer.tick(
+            format_jobs,
+            inputs=[client_id],
+            outputs=[jobs_display]
+        )
+
+        show_job_btn.click(
+            show_job,
+            inputs=[job_id_box, client_id],
+            outputs=[job_handbook]
+        )
+
+        resume_job_btn.click(
+            resume_job,
+            inputs=[job_id_box, client_id],
+            outputs=[job_handbook]
+        )
+
+        clear_btn.click(
+            clear_database,
+            inputs=[client_id],
+            outputs=[upload_status, docs_display]
+        )
+
+    return demo
+
 
 if __name__ == "__main__":
+    # Load environment variables
+    load_dotenv()
     print("🚀 Starting AI Handbook Generator...")
     print("📝 Make sure you have your GEMINI_API_KEY in .env file")
+    metrics_port = int(os.getenv('METRICS_PORT', '0'))
+    if metrics_port:
+        metrics.start_metrics_server(metrics_port)
+    if os.getenv('APP_WARMUP', 'on').lower() not in ('0', 'off', 'false', 'no'):
+        # Runs while Gradio starts; a request arriving first builds what it needs itself
+        threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+    else:
+        # Warm-up would build the job manager; without it, unfinished jobs still resume at launch
+        threading.Thread(target=resume_jobs, name='resume-jobs', daemon=True).start()
     print("🌐 Opening browser...")
     # FIX: theme moved here from gr.Blocks() to fix Gradio 6 deprecation warning
-    demo.launch(share=False, theme=gr.themes.Soft())
+    build_ui().launch(share=False, theme=gr.themes.Soft())
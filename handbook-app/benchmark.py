@@ -0,0 +1,288 @@
+"""End-to-end benchmark for ingest, retrieval and handbook generation.
+
+Generates synthetic PDFs of a controlled size, ingests them into a throwaway
+ChromaDB directory and writes the measurements as JSON:
+
+    python benchmark.py --pages 40 --docs 1,4,12 --output results.json
+    python benchmark.py --output new.json --compare results.json
+
+Generation runs against the in-process fake LLM backend, so no API quota is
+used and the numbers reflect our own overhead plus the configured latency.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+from typing import List, Dict, Optional
+
+import numpy as np
+
+_VOCABULARY = (
+    "pump valve pressure seal bearing motor coolant filter inspection torque calibration sensor "
+    "alarm shutdown startup procedure operator maintenance schedule lubrication safety lockout "
+    "permit hazard isolation flange gasket impeller housing shaft coupling alignment vibration "
+    "temperature flow rate discharge suction manifold relief gauge logbook audit checklist "
+    "training supervisor contractor emergency spill containment ventilation electrical panel"
+).split()
+
+
+def synthetic_page(rng: random.Random, words: int) -> str:
+    """A page of sentence-shaped text, with the odd part number for keyword search"""
+    sentences = []
+    count = 0
+    while count < words:
+        length = rng.randint(8, 20)
+        sentence = [rng.choice(_VOCABULARY) for _ in range(length)]
+        if rng.random() < 0.1:
+            sentence.insert(rng.randint(0, length), f"PN-{rng.randint(1000, 9999)}")
+        sentences.append(" ".join(sentence).capitalize() + ".")
+        count += length
+    return " ".join(sentences)
+
+
+def write_pdf(path: str, pages: List[str]):
+    """Write a minimal single-font PDF with one text page per entry"""
+
+    def escape(line: str) -> str:
+        return line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+               "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        lines = textwrap.wrap(text, 95) or [""]
+        stream = "BT /F1 10 Tf 40 800 Td 12 TL " + " ".join(f"({escape(line)}) '" for line in lines) + " ET"
+        page_object = len(objects) + 1
+        kids.append(f"{page_object} 0 R")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_object + 1} 0 R >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n{body}\nendobj\n".encode('latin-1')
+
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    data += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def latency_summary(samples: List[float]) -> Dict:
+    """p50/p95/p99/mean of a list of durations in seconds, reported in milliseconds"""
+    values = np.asarray(samples) * 1000
+    return {
+        'count': len(samples),
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'p99_ms': round(float(np.percentile(values, 99)), 3),
+        'mean_ms': round(float(values.mean()), 3),
+    }
+
+
+def rate(count: int, seconds: float) -> float:
+    return round(count / seconds, 2) if seconds > 0 else 0.0
+
+
+def benchmark_retrieval(processor, rng: random.Random, queries: int, k: int) -> Dict:
+    """Uncached get_relevant_context latency over random keyword queries, and the same queries as one batch"""
+    texts = [" ".join(rng.choice(_VOCABULARY) for _ in range(rng.randint(3, 6))) for _ in range(queries)]
+
+    samples = []
+    for query in texts:
+        processor.query_cache.invalidate()
+        started = time.perf_counter()
+        processor.get_relevant_context(query, k=k)
+        samples.append(time.perf_counter() - started)
+
+    processor.query_cache.invalidate()
+    started = time.perf_counter()
+    processor.get_relevant_contexts(texts, k=k)
+    batch = time.perf_counter() - started
+
+    return {
+        **latency_summary(samples),
+        'batch_ms': round(batch * 1000, 3),
+        'batch_per_query_ms': round(batch * 1000 / max(1, queries), 3),
+    }
+
+
+def benchmark_generation(processor, topic: str, latency: float, tokens_per_second: float) -> Dict:
+    """Wall time of a full streamed handbook against the fake LLM backend"""
+    os.environ.update({
+        'LLM_BACKEND': 'fake',
+        'FAKE_LLM_LATENCY': str(latency),
+        'FAKE_LLM_TOKENS_PER_SECOND': str(tokens_per_second),
+        'FAKE_LLM_ERROR_RATE': '0',
+        'RESPONSE_CACHE_DIR': '',
+    })
+    from handbook_generator import HandbookGenerator, HANDBOOK_SECTIONS
+
+    generator = HandbookGenerator()
+    context = processor.select_context(topic, k=10)
+
+    started = time.perf_counter()
+    first_section = None
+    handbook = ""
+    for handbook in generator.generate_handbook(topic, context, retrieve=processor.select_context,
+                                                  retrieve_many=processor.select_contexts):
+        if first_section is None:
+            first_section = time.perf_counter() - started
+    elapsed = time.perf_counter() - started
+
+    return {
+        'sections': len(HANDBOOK_SECTIONS),
+        'concurrency': generator.max_concurrency,
+        'llm_latency_s': latency,
+        'llm_tokens_per_second': tokens_per_second,
+        'first_section_s': round(first_section or elapsed, 3),
+        'wall_s': round(elapsed, 3),
+        'words': len(handbook.split()),
+    }
+
+
+def run(pages: int, words_per_page: int, doc_counts: List[int], queries: int, k: int,
+        llm_latency: float, llm_tokens_per_second: float, seed: int) -> Dict:
+    """Ingest ``max(doc_counts)`` synthetic PDFs, measuring retrieval at each corpus size"""
+    rng = random.Random(seed)
+
+    with tempfile.TemporaryDirectory(prefix="handbook-bench-") as workdir:
+        from pdf_processor import PDFProcessor
+
+        processor = PDFProcessor(persist_directory=os.path.join(workdir, "chroma"))
+        totals = {'pages': 0, 'extract_s': 0.0, 'chunks': 0, 'chunk_s': 0.0, 'added': 0, 'add_s': 0.0}
+        retrieval = []
+
+        for doc in range(1, max(doc_counts) + 1):
+            path = os.path.join(workdir, f"doc_{doc}.pdf")
+            write_pdf(path, [synthetic_page(rng, words_per_page) for _ in range(pages)])
+
+            started = time.perf_counter()
+            text = processor.extract_text_from_pdf(path)
+            totals['extract_s'] += time.perf_counter() - started
+            totals['pages'] += pages
+
+            started = time.perf_counter()
+            chunks = processor.chunk_text(text)
+            totals['chunk_s'] += time.perf_counter() - started
+            totals['chunks'] += len(chunks)
+
+            started = time.perf_counter()
+            ids = processor.add_to_vectordb(text, f"doc_{doc}.pdf")
+            totals['add_s'] += time.perf_counter() - started
+            totals['added'] += len(ids)
+
+            if doc in doc_counts:
+                print(f"⏱️  Retrieval with {doc} documents ({processor.collection.count()} chunks)")
+                retrieval.append({
+                    'documents': doc,
+                    'chunks': processor.collection.count(),
+                    **benchmark_retrieval(processor, rng, queries, k)
+                })
+
+        print("⏱️  Generating handbook against the fake LLM")
+        generation = benchmark_generation(processor, "Pump maintenance", llm_latency, llm_tokens_per_second)
+
+    return {
+        'extract': {'pages': totals['pages'], 'seconds': round(totals['extract_s'], 3),
+                    'pages_per_sec': rate(totals['pages'], totals['extract_s'])},
+        'chunk': {'chunks': totals['chunks'], 'seconds': round(totals['chunk_s'], 3),
+                  'chunks_per_sec': rate(totals['chunks'], totals['chunk_s'])},
+        'add_to_vectordb': {'chunks': totals['added'], 'seconds': round(totals['add_s'], 3),
+                            'chunks_per_sec': rate(totals['added'], totals['add_s'])},
+        'retrieval': retrieval,
+        'generate_handbook': generation,
+    }
+
+
+def flatten(results: Dict, prefix: str = "") -> Dict[str, float]:
+    """Numeric leaves keyed by dotted path; retrieval rows are keyed by document count"""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{path}."))
+        elif isinstance(value, list):
+            for row in value:
+                flat.update(flatten(row, f"{path}[{row.get('documents')}]."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(current: Dict, baseline_path: str):
+    """Print each metric next to the baseline run's value"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = flatten(json.load(f)['results'])
+
+    print(f"\n{'metric':<45} {'baseline':>12} {'current':>12} {'change':>8}")
+    for path, value in flatten(current).items():
+        if path not in baseline:
+            continue
+        old = baseline[path]
+        change = f"{(value - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"{path:<45} {old:>12} {value:>12} {change:>8}")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest, retrieval and handbook generation")
+    parser.add_argument('--pages', type=int, default=40, help="pages per synthetic PDF")
+    parser.add_argument('--words-per-page', type=int, default=350)
+    parser.add_argument('--docs', default="1,4,12", help="corpus sizes (documents) to measure retrieval at")
+    parser.add_argument('--queries', type=int, default=50, help="retrieval queries per corpus size")
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--llm-latency', type=float, default=1.0, help="fake LLM seconds to first token")
+    parser.add_argument('--llm-tokens-per-second', type=float, default=200.0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default="benchmark_results.json")
+    parser.add_argument('--compare', help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    doc_counts = sorted({int(count) for count in args.docs.split(",") if count.strip()})
+    config = {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}
+
+    results = run(args.pages, args.words_per_page, doc_counts, args.queries, args.k,
+                  args.llm_latency, args.llm_tokens_per_second, args.seed)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': _git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': config,
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print(json.dumps(results, indent=2))
+    print(f"\n✅ Results written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+from typing import List, Dict, Iterable, Tuple
+
+# Words, numbers and joined identifiers such as part numbers ("ab-1234", "v2.1")
+_TOKEN_RE = re.compile(r'[a-z0-9]+(?:[-_./][a-z0-9]+)*')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms; joined identifiers are indexed whole and by their parts"""
+    terms = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        term = match.group(0)
+        terms.append(term)
+        if not term.isalnum():
+            terms.extend(part for part in re.split(r'[-_./]', term) if part)
+    return terms
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """In-process inverted index ranking chunks by Okapi BM25.
+
+        Postings map each term to {chunk slot: term frequency}; chunk text is
+        not stored, only its ID and length.
+        """
+        self.k1 = k1
+        self.b = b
+
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._ids: List[str] = []
+        self._lengths: List[int] = []
+        self._slots: Dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def add(self, ids: List[str], documents: List[str]):
+        """Index a batch of chunks"""
+        with self._lock:
+            for chunk_id, document in zip(ids, documents):
+                if chunk_id in self._slots:
+                    continue
+
+                terms = tokenize(document)
+                slot = len(self._ids)
+                self._ids.append(chunk_id)
+                self._lengths.append(len(terms))
+                self._slots[chunk_id] = slot
+                self._total_length += len(terms)
+
+                for term, frequency in Counter(terms).items():
+                    self._postings.setdefault(term, {})[slot] = frequency
+
+    def remove(self, ids: Iterable[str]):
+        """Drop chunks from the index"""
+        with self._lock:
+            removed = set()
+            for chunk_id in ids:
+                slot = self._slots.pop(chunk_id, None)
+                if slot is None:
+                    continue
+
+                removed.add(slot)
+                self._total_length -= self._lengths[slot]
+                self._lengths[slot] = 0
+                self._ids[slot] = None
+
+            if not removed:
+                return
+
+            # One pass over the postings for the whole batch
+            for term in list(self._postings):
+                postings = self._postings[term]
+                for slot in removed.intersection(postings):
+                    del postings[slot]
+                if not postings:
+                    del self._postings[term]
+
+    def clear(self):
+        """Empty the index"""
+        with self._lock:
+            self._postings = {}
+            self._ids = []
+            self._lengths = []
+            self._slots = {}
+            self._total_length = 0
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """Return up to ``k`` (chunk ID, score) pairs, best first"""
+        with self._lock:
+            count = len(self._slots)
+            if not count:
+                return []
+
+            average_length = self._total_length / count
+            scores: Dict[int, float] = {}
+
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for slot, frequency in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[slot] / average_length)
+                    scores[slot] = scores.get(slot, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(self._ids[slot], score) for slot, score in best]
+
+    def __len__(self) -> int:
+        return len(self._slots)
@@ -0,0 +1,115 @@
+"""Local OpenAI-compatible server returning filler text, for offline load tests.
+
+Run it, then point the app at it:
+
+    python fake_llm_server.py --port 8001 --latency 0.5 --tokens-per-second 200 --error-rate 0.05
+    LLM_BACKEND=openai OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=fake python app.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_backends import fake_completion
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.5, tokens_per_second: float = 200.0,
+                 completion_tokens: int = 600, error_rate: float = 0.0, error_code: int = 429):
+        """Serves POST /v1/chat/completions with the given latency, token rate and error rate"""
+        super().__init__(address, FakeLLMHandler)
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.requests_served = 0
+        self._lock = threading.Lock()
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like a real provider
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)) or 0)
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send(404, {'error': {'message': f"Unknown path {self.path}"}})
+            return
+
+        try:
+            request = json.loads(body or b'{}')
+        except ValueError:
+            self._send(400, {'error': {'message': "Invalid JSON"}})
+            return
+
+        server = self.server
+        with server._lock:
+            server.requests_served += 1
+
+        time.sleep(server.latency)
+        if random.random() < server.error_rate:
+            self._send(server.error_code, {'error': {'message': "Injected error from fake server",
+                                                     'code': server.error_code}})
+            return
+
+        prompt = "\n".join(str(message.get('content', '')) for message in request.get('messages', []))
+        tokens = min(server.completion_tokens, request.get('max_tokens') or server.completion_tokens)
+        if server.tokens_per_second > 0:
+            time.sleep(tokens / server.tokens_per_second)
+
+        prompt_tokens = max(1, len(prompt) // 4)
+        self._send(200, {
+            'id': f"chatcmpl-fake-{server.requests_served}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'fake-model'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': fake_completion(prompt, tokens)},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': tokens,
+                      'total_tokens': prompt_tokens + tokens}
+        })
+
+    def _send(self, status: int, payload: dict):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument('--tokens-per-second', type=float, default=200.0)
+    parser.add_argument('--completion-tokens', type=int, default=600)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument('--error-code', type=int, default=429)
+    args = parser.parse_args()
+
+    server = FakeLLMServer((args.host, args.port), latency=args.latency,
+                           tokens_per_second=args.tokens_per_second, completion_tokens=args.completion_tokens,
+                           error_rate=args.error_rate, error_code=args.error_code)
+    print(f"🧪 Fake LLM server on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,79 @@
+import hashlib
+import json
 import os
-from typing import List, Dict
-
-# Try to import Google Genai - gracefully handle if not installed
-try:
-    from google import genai
-    from google.genai import types
-
-    GENAI_AVAILABLE = True
-except ImportError:
-    GENAI_AVAILABLE = False
-    print("⚠️  google-genai not installed. Running in demo mode.")
-    print("Install with: pip install google-genai")
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Iterable, Iterator, Callable, Optional, Tuple, Union
+
+import metrics
+from llm_backends import GENAI_AVAILABLE, create_backend
+from rate_limiter import get_rate_limiter
+from response_cache import ResponseCache
+from source_digest import SourceDigest, cite
+from text_chunker import estimate_tokens
+from token_budget import TokenBudget, output_tokens_for
+
+# Handbook sections in table-of-contents order: (title, instruction, context chunks).
+# The chunk count scales with each section's word budget.
+HANDBOOK_SECTIONS = [
+    ("Introduction", "Comprehensive introduction with background, scope, and importance. 1500+ words.", 4),
+    ("Historical Development", "Evolution, milestones, and key developments over time. 2500+ words.", 5),
+    ("Theoretical Foundations", "Core theories, concepts, and principles in detail. 4000+ words.", 8),
+    ("Practical Applications", "Real-world uses, implementations, and examples. 3000+ words.", 6),
+    ("Current State", "Recent developments, trends, and current landscape. 3000+ words.", 6),
+    ("Challenges", "Limitations, difficulties, and open problems. 2500+ words.", 5),
+    ("Future Directions", "Predictions, trends, and where field is heading. 2000+ words.", 4),
+    ("Case Studies", "Detailed examples and demonstrations. 2500+ words.", 5),
+    ("Conclusion", "Summary and synthesis of key points. 1000+ words.", 3)
+]
+
+
+def context_chunk_ids(context: List[Dict]) -> List[str]:
+    """Chunk IDs behind a list of contexts, in prompt order (merged spans list several)"""
+    return [chunk_id for ctx in context for chunk_id in ctx.get('ids', [ctx.get('id')])]
+
+
+def section_query(topic: str, section: Tuple[str, str, int]) -> str:
+    """Retrieval query for a section: the topic plus the section's focus (its instruction minus the word target)"""
+    section_title, instruction, _ = section
+    return f"{topic} - {section_title}: {instruction.split('.')[0]}"
 
 
 class HandbookGenerator:
     def __init__(self):
-        """Initialize handbook generator with Google Gemini API"""
+        """Initialize handbook generator with the configured LLM backend (Google Gemini by default)"""
         self.api_key = os.getenv('GEMINI_API_KEY')
+        self.backend_name = os.getenv('LLM_BACKEND', 'gemini').lower()
         self.demo_mode = False
 
-        if not self.api_key or self.api_key == 'your-api-key-here':
+        # Maximum number of section requests in flight at once
+        self.max_concurrency = max(1, int(os.getenv('HANDBOOK_MAX_CONCURRENCY', '4')))
+
+        # Identical prompts (FAQ answers, regenerated sections) are served from cache
+        self.response_cache = ResponseCache(
+            max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', '256')),
+            ttl_seconds=float(os.getenv('RESPONSE_CACHE_TTL', '86400')),
+            disk_dir=os.getenv('RESPONSE_CACHE_DIR') or None,
+            disk_max_entries=int(os.getenv('RESPONSE_CACHE_DISK_SIZE', '2048'))
+        )
+
+        # Shared across generators so all callers stay within one quota
+        self.rate_limiter = get_rate_limiter(self.backend_name)
+
+        # Every prompt is fitted to the model window; chat answers reserve this many output tokens
+        self.token_budget = TokenBudget()
+        self.response_tokens = int(os.getenv('LLM_RESPONSE_TOKENS', '2048'))
+
+        if self.backend_name != 'gemini':
+            try:
+                # OpenAI-compatible endpoint or the offline fake backend
+                self.backend = create_backend(self.backend_name)
+                self.model_name = self.backend.model_name
+                print(f"✅ LLM backend initialized: {self.backend_name} ({self.model_name})")
+            except Exception as e:
+                print(f"⚠️  Could not initialize LLM backend '{self.backend_name}': {e}")
+                print("Running in DEMO MODE")
+                self.demo_mode = True
+        elif not self.api_key or self.api_key == 'your-api-key-here':
             print("⚠️  No valid GEMINI_API_KEY found - running in DEMO MODE")
             print("To use real AI generation:")
             print("1. Get free API key: https://aistudio.google.com/app/apikey")
@@ -32,30 +86,37 @@ class HandbookGenerator:
         else:
             try:
                 # Initialize real API client
-                self.client = genai.Client(api_key=self.api_key)
-                self.model_name = 'gemini-2.0-flash-exp'
+                self.backend = create_backend('gemini')
+                self.model_name = self.backend.model_name
                 print("✅ Google Gemini API initialized successfully")
             except Exception as e:
                 print(f"⚠️  Could not initialize Gemini API: {e}")
                 print("Running in DEMO MODE")
                 self.demo_mode = True
 
+        # Optional map-reduce digest used as a shared prefix for section prompts:
+        # 'corpus' condenses every chunk, 'context' only the topic's retrieved chunks
+        self.digest_scope = os.getenv('HANDBOOK_DIGEST', 'off').lower()
+        self.digest_excerpts = int(os.getenv('DIGEST_EXCERPTS', '2'))
+        self.digest = None
+        if self.digest_scope in ('corpus', 'context') and not self.demo_mode:
+            self.digest = SourceDigest(
+                self._generate_content,
+                model_name=self.model_name,
+                cache_dir=os.getenv('DIGEST_CACHE_DIR', os.path.join('cache', 'digests')),
+                map_tokens=int(os.getenv('DIGEST_MAP_TOKENS', '6000')),
+                target_tokens=int(os.getenv('DIGEST_TOKENS', '4000')),
+                max_workers=self.max_concurrency
+            )
+
     def generate_response(self, query: str, context: List[Dict]) -> str:
         """Generate a response to a query using retrieved context"""
 
         if self.demo_mode:
             return self._generate_demo_response(query, context)
 
-        # Real API implementation
-        if context:
-            context_text = "\n\n".join([
-                f"[From {ctx['source']}]\n{ctx['text']}"
-                for ctx in context
-            ])
-        else:
-            context_text = "No context available."
-
-        prompt = f"""Based on the following context from uploaded documents, please answer the question.
+        def build_prompt(context_text: str) -> str:
+            return f"""Based on the following context from uploaded documents, please answer the question.
 
 Context:
 {context_text}
@@ -64,12 +125,21 @@ Question: {query}
 
 Please provide a clear, accurate answer based on the context provided. If the context doesn't contain relevant information, say so."""
 
+        # Keep the best-ranked chunks that fit beside the question and the answer
+        budget = self.token_budget.allocate(build_prompt(""), self.response_tokens)
+        context = self.token_budget.fit(context, budget['context'], lambda ctx: f"[From {cite(ctx)}]\n{ctx['text']}")
+
+        # Real API implementation
+        if context:
+            context_text = "\n\n".join([
+                f"[From {cite(ctx)}]\n{ctx['text']}"
+                for ctx in context
+            ])
+        else:
+            context_text = "No context available."
+
         try:
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=prompt
-            )
-            return response.text
+            return self._generate_content(build_prompt(context_text), budget['output'])
 
         except Exception as e:
             error_details = str(e)
@@ -96,43 +166,222 @@ Error details: {error_details}"""
 
             return f"❌ Error: {error_details}\n\nCheck https://aistudio.google.com/app/apikey for API status"
 
-    def generate_handbook(self, topic: str, context: List[Dict]) -> str:
-        """Generate a comprehensive handbook"""
+    def generate_handbook(self, topic: str, context: List[Dict],
+                          retrieve: Optional[Callable[[str, int], List[Dict]]] = None,
+                          completed: Optional[Dict[str, Dict]] = None,
+                          on_section: Optional[Callable[[str, str, List[Dict]], None]] = None,
+                          previous: Optional[Dict[str, Dict]] = None, digest: Optional[str] = None,
+                          retrieve_many: Optional[Callable[[List[str], List[int]], List[List[Dict]]]] = None
+                          ) -> Iterator[str]:
+        """Generate a comprehensive handbook, yielding the document as each section finishes.
+
+        When ``retrieve(query, k)`` is given, each section fetches its own context
+        for the topic plus the section's focus; otherwise every section shares
+        ``context``. ``retrieve_many(queries, ks)`` fetches every section's
+        context in one batch up front instead. The last value yielded is the
+        complete handbook.
+
+        ``completed`` maps section titles to already generated sections
+        ({'text', 'sources'}), which are reused instead of regenerated.
+        ``on_section(title, text, context)`` is called as each new section
+        succeeds, so callers can checkpoint it.
+
+        ``previous`` holds sections of an earlier handbook on the topic
+        ({'text', 'fingerprint'}); a section whose freshly retrieved context
+        has the same fingerprint is reused without calling the model.
+
+        With a ``digest`` (see ``build_digest``), every section prompt opens
+        with it as a shared prefix and carries only a few raw excerpts.
+        """
 
         if self.demo_mode:
             print("📝 Generating demo handbook...")
-            return self._generate_demo_handbook(topic, context)
-
-        print("📝 Generating handbook using Google Gemini (iterative approach)...")
-        return self._generate_real_handbook_iterative(topic, context)
-
-    def _generate_real_handbook_iterative(self, topic: str, context: List[Dict]) -> str:
-        """Generate real handbook section by section"""
-
-        sections = [
-            ("Introduction", "Comprehensive introduction with background, scope, and importance. 1500+ words."),
-            ("Historical Development", "Evolution, milestones, and key developments over time. 2500+ words."),
-            ("Theoretical Foundations", "Core theories, concepts, and principles in detail. 4000+ words."),
-            ("Practical Applications", "Real-world uses, implementations, and examples. 3000+ words."),
-            ("Current State", "Recent developments, trends, and current landscape. 3000+ words."),
-            ("Challenges", "Limitations, difficulties, and open problems. 2500+ words."),
-            ("Future Directions", "Predictions, trends, and where field is heading. 2000+ words."),
-            ("Case Studies", "Detailed examples and demonstrations. 2500+ words."),
-            ("Conclusion", "Summary and synthesis of key points. 1000+ words.")
-        ]
+            yield self._generate_demo_handbook(topic, context)
+            return
+
+        print(f"📝 Generating handbook using {self.model_name} (iterative approach)...")
+        with metrics.span('generate_handbook', backend=self.backend_name):
+            yield from self._generate_real_handbook_iterative(topic, context, retrieve, completed, on_section,
+                                                              previous, digest, retrieve_many)
+
+    def _generate_real_handbook_iterative(self, topic: str, context: List[Dict],
+                                          retrieve: Optional[Callable[[str, int], List[Dict]]] = None,
+                                          completed: Optional[Dict[str, Dict]] = None,
+                                          on_section: Optional[Callable[[str, str, List[Dict]], None]] = None,
+                                          previous: Optional[Dict[str, Dict]] = None,
+                                          digest: Optional[str] = None,
+                                          retrieve_many: Optional[Callable[[List[str], List[int]], List[List[Dict]]]] = None
+                                          ) -> Iterator[str]:
+        """Generate real handbook, running section calls concurrently"""
+
+        total_words = 0
+        section_parts = {}
+        # Only sources some section prompt actually used; each section reports its own context
+        sources = set()
+
+        for section_title, _, _ in HANDBOOK_SECTIONS:
+            if completed and section_title in completed:
+                section = completed[section_title]
+                section_parts[section_title] = f"\n## {section_title}\n\n{section['text']}\n"
+                sources.update(section.get('sources', []))
+                total_words += len(section['text'].split())
+        if section_parts:
+            print(f"   ↺ Reusing {len(section_parts)} finished section(s)")
+
+        pending = [section for section in HANDBOOK_SECTIONS if section[0] not in section_parts]
+        prefetched = self._prefetch_contexts(topic, pending, retrieve_many)
+
+        # Sections are independent, so fire them off together and slot each
+        # one back into table-of-contents order as it finishes
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        try:
+            futures = {
+                executor.submit(self._generate_section, topic, section, context, retrieve,
+                                (previous or {}).get(section[0]), digest, prefetched.get(section[0])): section[0]
+                for section in pending
+            }
+
+            for future in as_completed(futures):
+                section_title = futures[future]
+                try:
+                    section_text, section_context = future.result()
+                    sources.update(ctx['source'] for ctx in section_context)
+                    words = len(section_text.split())
+                    total_words += words
+
+                    section_parts[section_title] = f"\n## {section_title}\n\n{section_text}\n"
+                    print(f"   ✓ {section_title}: {words} words (Total: {total_words})")
+
+                except Exception as e:
+                    print(f"   ✗ {section_title} error: {str(e)}")
+                    section_parts[section_title] = f"\n## {section_title}\n\n[Error: {str(e)}]\n"
+                else:
+                    if on_section is not None:
+                        on_section(section_title, section_text, section_context)
+
+                if len(section_parts) < len(HANDBOOK_SECTIONS):
+                    yield self._assemble_handbook(topic, section_parts)
+        finally:
+            # Drop queued sections if the consumer stops listening
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        final = self._assemble_handbook(topic, section_parts, sorted(sources))
+        print(f"\n✅ Handbook complete: {len(final.split())} words")
+        yield final
+
+    def _prefetch_contexts(self, topic: str, sections: List[Tuple[str, str, int]],
+                           retrieve_many: Optional[Callable[[List[str], List[int]], List[List[Dict]]]] = None
+                           ) -> Dict[str, List[Dict]]:
+        """Every pending section's context from one batched retrieval; sections retrieve alone if it fails"""
+        if retrieve_many is None or not sections:
+            return {}
 
+        try:
+            batch = retrieve_many([section_query(topic, section) for section in sections],
+                                  [section[2] for section in sections])
+            return {section[0]: contexts for section, contexts in zip(sections, batch)}
+        except Exception as e:
+            print(f"⚠️  Batched section retrieval failed, retrieving per section: {e}")
+            return {}
+
+    def _assemble_handbook(self, topic: str, section_parts: Dict[str, str], sources: List[str] = None) -> str:
+        """Join finished sections in table-of-contents order, with references once complete"""
         handbook_parts = [f"# Handbook: {topic}\n\n## Table of Contents\n\n"]
-        for i, (title, _) in enumerate(sections, 1):
+        for i, (title, _, _) in enumerate(HANDBOOK_SECTIONS, 1):
             handbook_parts.append(f"{i}. {title}\n")
         handbook_parts.append("\n---\n\n")
 
-        context_text = "\n\n".join([f"[{ctx['source']}]\n{ctx['text']}" for ctx in context])
-        total_words = 0
+        for section_title, _, _ in HANDBOOK_SECTIONS:
+            if section_title in section_parts:
+                handbook_parts.append(section_parts[section_title])
 
-        for section_title, instruction in sections:
-            print(f"📝 Generating: {section_title}")
+        # Add references
+        if sources is not None:
+            handbook_parts.append(f"\n## References\n\nBased on:\n")
+            for source in sources:
+                handbook_parts.append(f"- {source}\n")
+
+        return "".join(handbook_parts)
+
+    def section_fingerprint(self, topic: str, section_title: str, section_context: List[Dict],
+                            digest: Optional[str] = None) -> str:
+        """Hash of everything a section's prompt depends on: model, topic, instruction, chunk IDs and digest"""
+        instruction = next(instruction for title, instruction, _ in HANDBOOK_SECTIONS if title == section_title)
+        digest_hash = hashlib.sha256(digest.encode('utf-8')).hexdigest() if digest else None
+        payload = json.dumps([getattr(self, 'model_name', None), topic, section_title, instruction,
+                              context_chunk_ids(section_context), digest_hash])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _generate_section(self, topic: str, section: Tuple[str, str, int], context: List[Dict],
+                          retrieve: Optional[Callable[[str, int], List[Dict]]] = None,
+                          previous: Optional[Dict] = None, digest: Optional[str] = None,
+                          prefetched: Optional[List[Dict]] = None) -> Tuple[str, List[Dict]]:
+        """Generate a single handbook section, returning its text and the context it used.
+
+        ``prefetched`` is the section's context from a batched retrieval, used
+        instead of calling ``retrieve``. If ``previous`` (the same section from
+        an earlier handbook) was built from the same context, its text is
+        returned instead.
+        """
+        section_title, instruction, context_k = section
+        print(f"📝 Generating: {section_title}")
+
+        with metrics.span('section', section=section_title) as fields:
+            section_context = prefetched or []
+            if prefetched is None and retrieve is not None:
+                section_context = retrieve(section_query(topic, section), context_k)
+            if not section_context:
+                section_context = context
+            if digest:
+                # The digest carries the breadth; a few excerpts keep specifics and citations
+                section_context = section_context[:self.digest_excerpts]
+
+            def build_prompt(context_text: str) -> str:
+                return self._section_prompt(topic, section_title, instruction, context_text, digest)
+
+            # Fit excerpts beside the instructions, the digest and the section's word target
+            budget = self.token_budget.allocate(build_prompt(""), output_tokens_for(instruction, self.response_tokens))
+            section_context = self.token_budget.fit(section_context, budget['context'],
+                                                    lambda ctx: f"[{cite(ctx)}]\n{ctx['text']}")
+
+            fingerprint = self.section_fingerprint(topic, section_title, section_context, digest)
+            if previous and previous.get('fingerprint') == fingerprint:
+                print(f"   ↺ {section_title}: context unchanged, reusing previous text")
+                metrics.inc('sections_reused_total')
+                fields['reused'] = True
+                return previous['text'], section_context
+
+            context_text = "\n\n".join([f"[{cite(ctx)}]\n{ctx['text']}" for ctx in section_context])
+            prompt = build_prompt(context_text)
+
+            text = self._generate_content(prompt, budget['output'])
+            fields.update(context_chunks=len(section_context), prompt_tokens=estimate_tokens(prompt),
+                          words=len(text.split()))
+            return text, section_context
+
+    def _section_prompt(self, topic: str, section_title: str, instruction: str, context_text: str,
+                        digest: Optional[str] = None) -> str:
+        """Prompt for one handbook section around the given excerpts"""
+        if digest:
+            # Identical opening across all sections so providers can reuse the cached prefix
+            return f"""You are writing a professional handbook on: {topic}
+
+SOURCE DIGEST (condensed from all source documents, with citations):
+{digest}
+
+---
 
-            prompt = f"""Write a detailed section for a professional handbook.
+Write a detailed section for the handbook.
+
+SECTION: {section_title}
+REQUIREMENTS: {instruction}
+
+KEY EXCERPTS:
+{context_text}
+
+Write the complete section with proper markdown formatting, drawing on the digest and excerpts and keeping their citations. Be comprehensive and detailed."""
+
+        return f"""Write a detailed section for a professional handbook.
 
 SECTION: {section_title}
 REQUIREMENTS: {instruction}
@@ -142,31 +391,53 @@ SOURCE MATERIALS:
 
 Write the complete section with proper markdown formatting. Be comprehensive and detailed."""
 
-            try:
-                response = self.client.models.generate_content(
-                    model=self.model_name,
-                    contents=prompt
-                )
-                section_text = response.text
-                words = len(section_text.split())
-                total_words += words
-
-                handbook_parts.append(f"\n## {section_title}\n\n{section_text}\n")
-                print(f"   ✓ {words} words (Total: {total_words})")
+    def build_digest(self, chunks: Union[List[Dict], Callable[[], Iterable[Dict]]]) -> Optional[str]:
+        """Condensed digest of ``chunks`` (a list, or a callable streaming them) for section prompts.
+
+        None when digests are off or there are no chunks.
+        """
+        if self.digest is None:
+            return None
+        return self.digest.build(chunks)
+
+    def _generate_content(self, prompt: str, output_tokens: Optional[int] = None) -> str:
+        """Send a prompt to the model, serving repeats from the response cache.
+
+        ``output_tokens`` is the expected response length; the request is
+        capped with some headroom above it so a runaway answer cannot stall
+        the call.
+        """
+        max_output_tokens = None
+        if output_tokens:
+            max_output_tokens = min(int(output_tokens * 1.5), self.token_budget.max_output_tokens)
+
+        model_key = f"{self.model_name}:{max_output_tokens}" if max_output_tokens else self.model_name
+        key = self.response_cache.make_key(model_key, prompt)
+        cached = self.response_cache.get(key)
+        metrics.inc('response_cache_total', result='hit' if cached is not None else 'miss')
+        if cached is not None:
+            return cached
+
+        with metrics.span('llm_call', backend=self.backend_name) as fields:
+            # Throttled to the quota, retrying 429/5xx with backoff
+            response = self.rate_limiter.call(
+                lambda: self.backend.generate_sync(prompt, max_output_tokens),
+                tokens=estimate_tokens(prompt)
+            )
 
-            except Exception as e:
-                print(f"   ✗ Error: {str(e)}")
-                handbook_parts.append(f"\n## {section_title}\n\n[Error: {str(e)}]\n")
+            text = response.text
+            # Provider-reported usage where available, estimates otherwise
+            prompt_tokens = response.prompt_tokens or estimate_tokens(prompt)
+            completion_tokens = response.completion_tokens or estimate_tokens(text or "")
+            fields.update(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
 
-        # Add references
-        sources = list(set([ctx['source'] for ctx in context]))
-        handbook_parts.append(f"\n## References\n\nBased on:\n")
-        for source in sources:
-            handbook_parts.append(f"- {source}\n")
+        metrics.inc('llm_requests_total', backend=self.backend_name)
+        metrics.inc('llm_tokens_total', prompt_tokens, backend=self.backend_name, kind='prompt')
+        metrics.inc('llm_tokens_total', completion_tokens, backend=self.backend_name, kind='completion')
 
-        final = "".join(handbook_parts)
-        print(f"\n✅ Handbook complete: {len(final.split())} words")
-        return final
+        if text:
+            self.response_cache.put(key, text)
+        return text
 
     def _generate_demo_response(self, query: str, context: List[Dict]) -> str:
         """Generate demo response when API not available"""
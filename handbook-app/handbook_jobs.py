@@ -0,0 +1,399 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from typing import Any, List, Dict, Callable, Iterable, Optional, Tuple
+
+import metrics
+from handbook_generator import HandbookGenerator, HANDBOOK_SECTIONS
+
+# Statuses a job can be in; queued and running jobs are picked up again after a restart
+QUEUED, RUNNING, DONE, ERROR = 'queued', 'running', 'done', 'error'
+
+
+def default_jobs_dir() -> str:
+    """Where job records are checkpointed (HANDBOOK_JOBS_DIR)"""
+    return os.getenv('HANDBOOK_JOBS_DIR', os.path.join('cache', 'jobs'))
+
+
+def has_unfinished_jobs(jobs_dir: Optional[str] = None) -> bool:
+    """Whether a previous run left queued or running jobs on disk, without building a job manager"""
+    jobs_dir = jobs_dir or default_jobs_dir()
+    if not os.path.isdir(jobs_dir):
+        return False
+
+    for name in os.listdir(jobs_dir):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(jobs_dir, name), 'r', encoding='utf-8') as f:
+                if json.load(f)['status'] in (QUEUED, RUNNING):
+                    return True
+        except Exception:
+            continue
+    return False
+
+
+class HandbookJobManager:
+    def __init__(self, generator: HandbookGenerator, select_context: Callable[[str, int], List[Dict]],
+                 save: Optional[Callable[[str, str, Dict[str, Dict], Optional[str]], str]] = None,
+                 load_previous: Optional[Callable[[str, Optional[str]], Dict[str, Dict]]] = None,
+                 jobs_dir: Optional[str] = None,
+                 max_workers: Optional[int] = None, max_pending: Optional[int] = None,
+                 select_contexts: Optional[Callable[[List[str], List[int]], List[List[Dict]]]] = None,
+                 history: Optional[int] = None, retention_days: Optional[float] = None,
+                 find_session: Optional[Callable[[str], Any]] = None):
+        """Runs handbook generation as background jobs on a bounded worker pool.
+
+        Every finished section is checkpointed to ``jobs_dir``, so a job
+        interrupted by a crash or restart resumes from the sections it already
+        paid for. Unfinished jobs found on disk are requeued at startup.
+
+        ``save(handbook, topic, sections, owner)`` stores the result along with
+        each section's text and context fingerprint; ``load_previous(topic,
+        owner)`` returns those sections from the owner's last handbook on the
+        topic, so sections whose context is unchanged are not regenerated.
+
+        Only queued and running jobs are held in memory in full; finished jobs
+        keep a summary, with their sections on disk. Finished records beyond
+        ``history`` jobs or older than ``retention_days`` are deleted.
+
+        ``select_contexts(queries, ks)``, when given, retrieves every section's
+        context in one batch.
+
+        ``find_session(owner)`` returns the owner's live session (or None once
+        it has ended). Each job keeps its session busy until it finishes, and
+        retrieves from it when resumed; a job whose session is gone fails
+        rather than generating from other documents.
+        """
+        self.generator = generator
+        self.select_context = select_context
+        self.select_contexts = select_contexts
+        self.save = save
+        self.load_previous = load_previous
+        self.jobs_dir = jobs_dir or default_jobs_dir()
+        self.max_workers = max_workers or int(os.getenv('HANDBOOK_JOB_WORKERS', '2'))
+        self.max_pending = max_pending or int(os.getenv('HANDBOOK_JOB_QUEUE', '16'))
+        self.history = history or int(os.getenv('HANDBOOK_JOB_HISTORY', '200'))
+        self.retention_days = retention_days or float(os.getenv('HANDBOOK_JOB_RETENTION_DAYS', '7'))
+        self.find_session = find_session
+
+        self._jobs: Dict[str, Dict] = {}
+        self._partials: Dict[str, str] = {}
+        self._selectors: Dict[str, Callable[[str, int], List[Dict]]] = {}
+        self._batch_selectors: Dict[str, Callable[[List[str], List[int]], List[List[Dict]]]] = {}
+        self._corpora: Dict[str, Callable[[], Iterable[Dict]]] = {}
+        self._holds: Dict[str, Tuple[Any, ExitStack]] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='handbook-job')
+
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self._resume_unfinished()
+
+    def submit(self, topic: str, select_context: Optional[Callable[[str, int], List[Dict]]] = None,
+               owner: Optional[str] = None, corpus: Optional[Callable[[], Iterable[Dict]]] = None,
+               select_contexts: Optional[Callable[[List[str], List[int]], List[List[Dict]]]] = None) -> str:
+        """Queue a handbook on ``topic`` and return its job ID.
+
+        ``select_context`` retrieves from the requesting session's documents
+        (default: the manager's), and ``select_contexts`` is its batched form;
+        ``owner`` tags the job for ``list_jobs``; ``corpus`` streams every
+        chunk, for a corpus-wide source digest.
+        """
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if job['status'] in (QUEUED, RUNNING))
+            if pending >= self.max_pending:
+                raise RuntimeError(f"Too many handbook jobs in progress ({pending}); try again shortly")
+
+            job_id = uuid.uuid4().hex[:12]
+            now = time.time()
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'topic': topic,
+                'owner': owner,
+                'status': QUEUED,
+                'created': now,
+                'updated': now,
+                'sections': {},
+                'filename': None,
+                'error': None,
+                'words': 0,
+            }
+            self._save_job(self._jobs[job_id])
+            if select_context is not None:
+                self._selectors[job_id] = select_context
+            if select_contexts is not None:
+                self._batch_selectors[job_id] = select_contexts
+            if corpus is not None:
+                self._corpora[job_id] = corpus
+
+        self._hold(job_id, owner)
+        metrics.inc('jobs_total', status=QUEUED)
+        self._executor.submit(self._run, job_id)
+        print(f"📋 Queued handbook job {job_id}: {topic}")
+        return job_id
+
+    def resume(self, job_id: str, owner: Optional[str] = None) -> bool:
+        """Requeue a finished or failed job (only ``owner``'s if given), regenerating unfinished sections"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] in (QUEUED, RUNNING) or not _owned(job, owner):
+                return False
+            job = self._load_job(job_id)
+            if job is None:
+                return False
+            job.update(status=QUEUED, error=None, updated=time.time())
+            self._jobs[job_id] = job
+            self._save_job(job)
+
+        self._hold(job_id, job['owner'])
+        self._executor.submit(self._run, job_id)
+        return True
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        """Job summary (no section text), or None for an unknown ID"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._summary(job) if job else None
+
+    def list_jobs(self, owner: Optional[str] = None) -> List[Dict]:
+        """Summaries of known jobs (only ``owner``'s if given), newest first"""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if _owned(job, owner)]
+            jobs.sort(key=lambda job: job['created'], reverse=True)
+            return [self._summary(job) for job in jobs]
+
+    def handbook(self, job_id: str, owner: Optional[str] = None) -> Optional[str]:
+        """The handbook so far (only ``owner``'s if given): live progress while running, the saved file once done"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not _owned(job, owner):
+                return None
+            partial = self._partials.get(job_id)
+            filename = job['filename']
+            topic = job['topic']
+            sections = job.get('sections')
+
+        if partial is not None:
+            return partial
+        if filename and os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8') as f:
+                return f.read()
+
+        if sections is None:
+            # Finished job without a saved file (e.g. it failed): its sections are on disk
+            with self._lock:
+                sections = (self._load_job(job_id) or {}).get('sections', {})
+        parts = {title: f"\n## {title}\n\n{section['text']}\n" for title, section in sections.items()}
+        return self.generator._assemble_handbook(topic, parts)
+
+    def shutdown(self, wait: bool = False):
+        """Stop taking work; running jobs keep their checkpoints and resume on next start"""
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _run(self, job_id: str):
+        """Generate one job's handbook, checkpointing as sections finish"""
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(status=RUNNING, updated=time.time())
+            self._save_job(job)
+            topic = job['topic']
+            completed = dict(job['sections'])
+            select_context = self._selectors.get(job_id)
+            select_contexts = self._batch_selectors.get(job_id)
+            corpus = self._corpora.get(job_id)
+            session = self._holds[job_id][0] if job_id in self._holds else None
+
+        print(f"🔄 Running handbook job {job_id}: {topic}")
+        try:
+            if select_context is None:
+                # Resumed jobs retrieve from their owner's session, never from someone else's documents
+                if self.find_session and job['owner']:
+                    if session is None:
+                        raise RuntimeError("this job's session has ended and its documents are gone; "
+                                           "upload them again and start a new handbook")
+                    select_context, select_contexts = session.select_context, session.select_contexts
+                    corpus = session.iter_chunks
+                else:
+                    select_context, select_contexts = self.select_context, self.select_contexts
+
+            with metrics.span('handbook_job') as fields:
+                context = select_context(topic, 10)
+                previous = self.load_previous(topic, job['owner']) if self.load_previous else None
+                digest = self._build_digest(context, corpus)
+
+                handbook = ""
+                for handbook in self.generator.generate_handbook(
+                        topic, context, retrieve=select_context, completed=completed,
+                        on_section=lambda title, text, section_context: self._checkpoint(
+                            job_id, title, text, section_context, digest),
+                        previous=previous, digest=digest, retrieve_many=select_contexts):
+                    with self._lock:
+                        self._partials[job_id] = handbook
+
+                with self._lock:
+                    sections = dict(job['sections'])
+                filename = self.save(handbook, topic, sections, job['owner']) if self.save else None
+                fields.update(job_id=job_id, reused_sections=len(completed), words=len(handbook.split()))
+
+            with self._lock:
+                job.update(status=DONE, filename=filename, words=len(handbook.split()), updated=time.time())
+                self._retire(job)
+            metrics.inc('jobs_total', status=DONE)
+            print(f"✅ Handbook job {job_id} done: {filename}")
+
+        except Exception as e:
+            print(f"❌ Handbook job {job_id} failed: {e}")
+            with self._lock:
+                job.update(status=ERROR, error=str(e), updated=time.time())
+                self._retire(job)
+            metrics.inc('jobs_total', status=ERROR)
+
+        finally:
+            with self._lock:
+                self._partials.pop(job_id, None)
+                self._selectors.pop(job_id, None)
+                self._batch_selectors.pop(job_id, None)
+                self._corpora.pop(job_id, None)
+                _, hold = self._holds.pop(job_id, (None, None))
+            if hold is not None:
+                hold.close()
+
+    def _build_digest(self, context: List[Dict], corpus: Optional[Callable[[], Iterable[Dict]]]) -> Optional[str]:
+        """Source digest for a job, if enabled; generation carries on without one if it fails"""
+        if self.generator.digest is None:
+            return None
+
+        try:
+            # The corpus is streamed rather than loaded; the digest reads it as needed
+            chunks = corpus if self.generator.digest_scope == 'corpus' and corpus else context
+            return self.generator.build_digest(chunks)
+        except Exception as e:
+            print(f"⚠️  Source digest failed, using raw excerpts: {e}")
+            return None
+
+    def _checkpoint(self, job_id: str, title: str, text: str, section_context: List[Dict],
+                    digest: Optional[str] = None):
+        """Persist one finished section so it survives a crash"""
+        try:
+            with self._lock:
+                job = self._jobs[job_id]
+                job['sections'][title] = {
+                    'text': text,
+                    'sources': sorted(set(ctx['source'] for ctx in section_context)),
+                    'fingerprint': self.generator.section_fingerprint(job['topic'], title, section_context, digest)
+                }
+                job['updated'] = time.time()
+                self._save_job(job)
+        except Exception as e:
+            print(f"Could not checkpoint section {title} of job {job_id}: {e}")
+
+    def _hold(self, job_id: str, owner: Optional[str]):
+        """Keep the owner's session busy until the job finishes, so it is not evicted while queued"""
+        session = self.find_session(owner) if self.find_session and owner else None
+        if session is None:
+            return
+
+        hold = ExitStack()
+        hold.enter_context(session.busy())
+        with self._lock:
+            self._holds[job_id] = (session, hold)
+
+    def _retire(self, job: Dict):
+        """Save a finished job, keep only its summary in memory and prune old records (caller holds the lock)"""
+        self._save_job(job)
+        self._jobs[job['job_id']] = _light(job)
+        self._prune()
+
+    def _prune(self):
+        """Delete finished job records past the history limit or retention period (caller holds the lock)"""
+        cutoff = time.time() - self.retention_days * 86400
+        finished = sorted((job for job in self._jobs.values() if job['status'] in (DONE, ERROR)),
+                          key=lambda job: job['updated'], reverse=True)
+
+        for index, job in enumerate(finished):
+            if index < self.history and job['updated'] >= cutoff:
+                continue
+            del self._jobs[job['job_id']]
+            try:
+                os.remove(self._job_path(job['job_id']))
+            except OSError:
+                pass
+
+    def _load_job(self, job_id: str) -> Optional[Dict]:
+        """Full job record from disk (caller holds the lock)"""
+        try:
+            with open(self._job_path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Could not load handbook job {job_id}: {e}")
+            return None
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _resume_unfinished(self):
+        """Load jobs from disk and requeue any that were queued or running when the process stopped"""
+        unfinished = []
+        for name in sorted(os.listdir(self.jobs_dir)):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.jobs_dir, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    job = json.load(f)
+            except Exception as e:
+                print(f"Could not load handbook job {path}: {e}")
+                continue
+
+            if job['status'] in (QUEUED, RUNNING):
+                job['status'] = QUEUED
+                self._jobs[job['job_id']] = job
+                unfinished.append(job)
+            else:
+                self._jobs[job['job_id']] = _light(job)
+
+        with self._lock:
+            self._prune()
+
+        for job in sorted(unfinished, key=lambda job: job['created']):
+            print(f"↺ Resuming handbook job {job['job_id']} ({len(job['sections'])}/{len(HANDBOOK_SECTIONS)} sections done)")
+            self._hold(job['job_id'], job['owner'])
+            self._executor.submit(self._run, job['job_id'])
+
+    def _save_job(self, job: Dict):
+        """Write a job record atomically (caller holds the lock)"""
+        path = self._job_path(job['job_id'])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, path)
+
+    def _summary(self, job: Dict) -> Dict:
+        return {
+            'job_id': job['job_id'],
+            'topic': job['topic'],
+            'status': job['status'],
+            'sections_done': job['sections_done'] if 'sections_done' in job else len(job['sections']),
+            'total_sections': len(HANDBOOK_SECTIONS),
+            'words': job['words'],
+            'filename': job['filename'],
+            'error': job['error'],
+            'created': job['created'],
+            'updated': job['updated'],
+        }
+
+
+def _owned(job: Dict, owner: Optional[str]) -> bool:
+    """Whether ``owner`` may see a job; no owner means any job"""
+    return owner is None or job.get('owner') == owner
+
+
+def _light(job: Dict) -> Dict:
+    """A finished job's record without its section text"""
+    light = {key: value for key, value in job.items() if key != 'sections'}
+    light['sections_done'] = len(job.get('sections', {}))
+    return light
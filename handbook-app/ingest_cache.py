@@ -0,0 +1,62 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Optional
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """Hash a file's contents without reading it into memory at once"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestCache:
+    def __init__(self, path: Optional[str] = None):
+        """Content-addressed record of ingested files, optionally backed by a JSON file"""
+        self.path = path
+        self._entries: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except Exception as e:
+                print(f"Could not load ingest cache {path}: {e}")
+
+    def get(self, content_hash: str) -> Optional[Dict]:
+        """Return the cached entry for a content hash, if any"""
+        with self._lock:
+            return self._entries.get(content_hash)
+
+    def put(self, content_hash: str, entry: Dict):
+        """Record an ingested file under its content hash"""
+        with self._lock:
+            self._entries[content_hash] = entry
+            self._save()
+
+    def clear(self):
+        """Forget every cached entry"""
+        with self._lock:
+            self._entries = {}
+            self._save()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _save(self):
+        """Write entries to disk (caller holds the lock)"""
+        if not self.path:
+            return
+
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Could not save ingest cache {self.path}: {e}")
@@ -0,0 +1,195 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Iterator, Optional
+
+import metrics
+from ingest_cache import file_sha256
+
+# Markers a file's producer thread puts on the queue after its last chunk
+_DONE = object()
+_FAILED = object()
+
+
+class IngestScheduler:
+    def __init__(self, processor, max_files: Optional[int] = None, batch_size: Optional[int] = None):
+        """Ingest several PDFs at once, embedding their chunks in shared batches.
+
+        Files are extracted and chunked concurrently; a single consumer groups
+        chunks from all of them into embedding batches of ``batch_size``.
+        """
+        self.processor = processor
+        self.max_files = max_files or int(os.getenv('INGEST_MAX_FILES', '4'))
+        self.batch_size = batch_size or processor.embed_batch_size
+
+    def run(self, pdf_paths: List[str]) -> Iterator[Dict]:
+        """Ingest files, yielding a status dict for each one as it completes.
+
+        Each status has ``path``, ``source`` and ``status`` ('processed',
+        'cached' or 'error'); successful files also carry ``chars``,
+        ``preview`` and ``chunk_ids``, failed ones an ``error`` message.
+        """
+        if not pdf_paths:
+            return
+
+        # Bounded so fast extractors cannot run far ahead of embedding
+        chunk_queue = queue.Queue(maxsize=self.batch_size * 4)
+        stop = threading.Event()
+        files = {}
+        batch = []
+
+        threads = ThreadPoolExecutor(max_workers=self.max_files)
+
+        try:
+            for index, path in enumerate(pdf_paths):
+                files[index] = {
+                    'path': path,
+                    'source': path,
+                    'doc_id': self.processor.new_doc_id(),
+                    'next_chunk': 0,
+                    'ids': [],
+                    'stats': {},
+                    'index_seconds': 0.0,
+                }
+                threads.submit(self._produce, index, files[index], chunk_queue, stop)
+
+            remaining = len(pdf_paths)
+            while remaining:
+                index, item = chunk_queue.get()
+
+                if item is _DONE or item is _FAILED:
+                    remaining -= 1
+                    # Flush so this file's last chunks are searchable before reporting it
+                    if any(entry_index == index for entry_index, _ in batch):
+                        self._flush(batch, files)
+                        batch = []
+                    yield self._finish(files[index], failed=item is _FAILED or 'insert_error' in files[index])
+                    continue
+
+                batch.append((index, item))
+                if len(batch) >= self.batch_size:
+                    self._flush(batch, files)
+                    batch = []
+        finally:
+            # Release producers blocked on a full queue if the caller stopped early
+            stop.set()
+            threads.shutdown(wait=False, cancel_futures=True)
+
+    def _produce(self, index: int, state: Dict, chunk_queue: queue.Queue, stop: threading.Event):
+        """Hash, extract and chunk one file onto the queue (runs on a worker thread).
+
+        Results other than chunks are written to ``state`` before the file's
+        end marker is queued, so the consumer sees them once it gets the marker.
+        """
+        try:
+            state['content_hash'] = file_sha256(state['path'])
+            state['cached'] = self.processor.ingest_cache.get(state['content_hash'])
+
+            if not state['cached']:
+                # Time spent waiting on a full queue is embedding backpressure, not extraction
+                with metrics.span('extract_file') as fields:
+                    stats = state['stats']
+                    chunks = 0
+                    waited = 0.0
+                    pages = self.processor.iter_pages(state['path'])
+                    for chunk in self.processor.iter_chunks(self.processor.track_pages(pages, stats)):
+                        started = time.perf_counter()
+                        queued = self._put(chunk_queue, (index, chunk), stop)
+                        waited += time.perf_counter() - started
+                        if not queued:
+                            return
+                        chunks += 1
+
+                    fields.update(file=os.path.basename(state['path']), pages=stats['pages'], chars=stats['chars'],
+                                  chunks=chunks, queue_wait_ms=round(waited * 1000, 3))
+
+                if not state['stats']['chars']:
+                    raise Exception("No text could be extracted from the PDF")
+
+            self._put(chunk_queue, (index, _DONE), stop)
+        except Exception as e:
+            state['error'] = str(e)
+            self._put(chunk_queue, (index, _FAILED), stop)
+
+    def _put(self, chunk_queue: queue.Queue, item: tuple, stop: threading.Event) -> bool:
+        """Queue an item, giving up once the run has been stopped"""
+        while not stop.is_set():
+            try:
+                chunk_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _flush(self, batch: List[tuple], files: Dict[int, Dict]):
+        """Embed and insert one cross-file batch of chunks.
+
+        If the insert fails, every file with chunks in the batch is marked
+        failed and the chunks it already inserted are removed; their later
+        chunks are dropped.
+        """
+        documents, metadatas, ids = [], [], []
+
+        for index, chunk in batch:
+            state = files[index]
+            if state.get('error') or 'insert_error' in state:
+                continue
+
+            chunk_number = state['next_chunk']
+            state['next_chunk'] += 1
+            chunk_id = f"{state['doc_id']}_chunk_{chunk_number}"
+
+            documents.append(chunk['text'])
+            metadatas.append(self.processor.chunk_metadata(chunk, state['source'], state['doc_id'], chunk_number))
+            ids.append(chunk_id)
+            state['ids'].append(chunk_id)
+
+        if not documents:
+            return
+
+        try:
+            started = time.perf_counter()
+            self.processor.insert_chunks(documents, metadatas, ids)
+            # Shared batches: each file is charged for its share of the chunks
+            elapsed = time.perf_counter() - started
+            for index, _ in batch:
+                files[index]['index_seconds'] += elapsed / len(batch)
+        except Exception as e:
+            print(f"Embedding batch failed: {e}")
+            for index in {index for index, _ in batch}:
+                state = files[index]
+                if state.get('error') or 'insert_error' in state:
+                    continue
+                state['insert_error'] = str(e)
+                try:
+                    self.processor.delete_chunks(state['ids'])
+                    state['ids'] = []
+                except Exception as cleanup_error:
+                    print(f"Could not remove chunks of {state['source']}: {cleanup_error}")
+
+    def _finish(self, state: Dict, failed: bool) -> Dict:
+        """Record a completed file and build its status"""
+        path = state['path']
+        source = state['source']
+
+        if failed:
+            self.processor.delete_chunks(state['ids'])
+            error = state.get('error') or state['insert_error']
+            return {'path': path, 'source': source, 'status': 'error', 'error': error}
+
+        # The same content may have been uploaded twice in one run
+        cached = state['cached'] or self.processor.ingest_cache.get(state['content_hash'])
+        if cached:
+            self.processor.delete_chunks(state['ids'])
+            print(f"Skipping {source}: already ingested as {cached['source']}")
+            return {'path': path, **cached, 'status': 'cached'}
+
+        stats = state['stats']
+        entry = {'source': source, 'chars': stats['chars'], 'preview': stats['preview'], 'chunk_ids': state['ids']}
+        self.processor.ingest_cache.put(state['content_hash'], entry)
+        self.processor.record_document()
+        metrics.observe('index_file_seconds', state['index_seconds'])
+        print(f"Added {len(state['ids'])} chunks from {source}")
+        return {'path': path, **entry, 'status': 'processed'}
@@ -0,0 +1,242 @@
+import asyncio
+import hashlib
+import importlib.util
+import os
+import random
+import threading
+from abc import ABC, abstractmethod
+from typing import Optional
+
+
+def _installed(module: str) -> bool:
+    """Whether a module can be imported, without paying to import it"""
+    try:
+        return importlib.util.find_spec(module) is not None
+    except ImportError:
+        return False
+
+
+# Each provider SDK is optional - a backend only needs its own, and imports it
+# when it is first created so app startup does not pay for SDKs it may not use
+GENAI_AVAILABLE = _installed('google.genai')
+if not GENAI_AVAILABLE:
+    print("⚠️  google-genai not installed. Running in demo mode.")
+    print("Install with: pip install google-genai")
+
+OPENAI_AVAILABLE = _installed('openai') and _installed('httpx')
+
+_FILLER_WORDS = (
+    "the handbook describes process quality safety equipment procedure operators should review "
+    "each step carefully before starting maintenance records inspection training system "
+    "requirements standard practice team documentation"
+).split()
+
+
+class LLMResponse:
+    def __init__(self, text: str, prompt_tokens: int = 0, completion_tokens: int = 0):
+        """Generated text plus the token usage the provider reported"""
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+
+class LLMBackend(ABC):
+    """Async text generation backend.
+
+    Subclasses implement ``generate``; synchronous callers use ``generate_sync``,
+    which runs every call on one shared event loop so HTTP connections stay
+    pooled and kept alive between requests.
+    """
+
+    name = 'base'
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    @abstractmethod
+    async def generate(self, prompt: str, max_output_tokens: Optional[int] = None) -> LLMResponse:
+        """Complete ``prompt``, stopping after ``max_output_tokens`` when given"""
+
+    async def aclose(self):
+        """Release connections held by the backend"""
+
+    def generate_sync(self, prompt: str, max_output_tokens: Optional[int] = None) -> LLMResponse:
+        """Blocking ``generate`` for thread-based callers"""
+        return run_sync(self.generate(prompt, max_output_tokens))
+
+    def close(self):
+        run_sync(self.aclose())
+
+
+class GeminiBackend(LLMBackend):
+    name = 'gemini'
+
+    def __init__(self, api_key: str, model_name: str = 'gemini-2.0-flash-exp'):
+        """Google Gemini through the google-genai async client"""
+        super().__init__(model_name)
+        if not GENAI_AVAILABLE:
+            raise RuntimeError("google-genai is not installed")
+        from google import genai
+
+        self.client = genai.Client(api_key=api_key)
+
+    async def generate(self, prompt: str, max_output_tokens: Optional[int] = None) -> LLMResponse:
+        kwargs = {'config': {'max_output_tokens': max_output_tokens}} if max_output_tokens else {}
+        response = await self.client.aio.models.generate_content(model=self.model_name, contents=prompt, **kwargs)
+        usage = getattr(response, 'usage_metadata', None)
+        return LLMResponse(
+            response.text,
+            prompt_tokens=getattr(usage, 'prompt_token_count', None) or 0,
+            completion_tokens=getattr(usage, 'candidates_token_count', None) or 0
+        )
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    name = 'openai'
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None, model_name: str = 'gpt-4o-mini',
+                 max_connections: int = 16, timeout: float = 120.0, max_tokens: Optional[int] = None):
+        """Any OpenAI-compatible chat completions endpoint (OpenAI, DeepSeek, vLLM, the fake server).
+
+        Requests share one pooled HTTP client, created on first use inside the
+        backend's event loop.
+        """
+        super().__init__(model_name)
+        if not OPENAI_AVAILABLE:
+            raise RuntimeError("openai is not installed")
+        if not api_key:
+            raise RuntimeError("no API key set (OPENAI_API_KEY)")
+        self.api_key = api_key
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_tokens = max_tokens
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            import httpx
+            from openai import AsyncOpenAI
+
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                timeout=self.timeout
+            )
+            # Retries are left to the shared rate limiter
+            self._client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url,
+                                       http_client=http_client, max_retries=0)
+        return self._client
+
+    async def generate(self, prompt: str, max_output_tokens: Optional[int] = None) -> LLMResponse:
+        # The per-call cap applies within any configured OPENAI_MAX_TOKENS ceiling
+        max_tokens = min(filter(None, (self.max_tokens, max_output_tokens)), default=None)
+        kwargs = {'max_tokens': max_tokens} if max_tokens else {}
+        response = await self._get_client().chat.completions.create(
+            model=self.model_name,
+            messages=[{"role": "user", "content": prompt}],
+            **kwargs
+        )
+        usage = response.usage
+        return LLMResponse(
+            response.choices[0].message.content or "",
+            prompt_tokens=getattr(usage, 'prompt_tokens', 0) or 0,
+            completion_tokens=getattr(usage, 'completion_tokens', 0) or 0
+        )
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+class FakeBackendError(Exception):
+    def __init__(self, message: str, code: int = 429):
+        super().__init__(message)
+        self.code = code
+
+
+class FakeBackend(LLMBackend):
+    name = 'fake'
+
+    def __init__(self, latency: float = 0.5, tokens_per_second: float = 200.0, completion_tokens: int = 600,
+                 error_rate: float = 0.0, error_code: int = 429, seed: Optional[int] = None):
+        """In-process stand-in for a provider, for load tests that must not spend quota.
+
+        Each call waits ``latency`` seconds (time to first token) plus
+        ``completion_tokens / tokens_per_second``, and fails with ``error_code``
+        at ``error_rate``.
+        """
+        super().__init__('fake-model')
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self._random = random.Random(seed)
+
+    async def generate(self, prompt: str, max_output_tokens: Optional[int] = None) -> LLMResponse:
+        await asyncio.sleep(self.latency)
+        if self._random.random() < self.error_rate:
+            raise FakeBackendError(f"{self.error_code} injected error from fake backend", self.error_code)
+
+        completion_tokens = min(self.completion_tokens, max_output_tokens or self.completion_tokens)
+        if self.tokens_per_second > 0:
+            await asyncio.sleep(completion_tokens / self.tokens_per_second)
+        return LLMResponse(
+            fake_completion(prompt, completion_tokens),
+            prompt_tokens=max(1, len(prompt) // 4),
+            completion_tokens=completion_tokens
+        )
+
+
+def fake_completion(prompt: str, tokens: int) -> str:
+    """Deterministic filler text of about ``tokens`` tokens, seeded by the prompt"""
+    seed = int(hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8], 16)
+    rng = random.Random(seed)
+    words = [rng.choice(_FILLER_WORDS) for _ in range(max(1, tokens * 3 // 4))]
+
+    lines = []
+    for start in range(0, len(words), 60):
+        lines.append(" ".join(words[start:start + 60]).capitalize() + ".")
+    return "\n\n".join(lines)
+
+
+def create_backend(name: Optional[str] = None) -> LLMBackend:
+    """Build the backend named by ``name`` or LLM_BACKEND (gemini, openai or fake)"""
+    name = (name or os.getenv('LLM_BACKEND', 'gemini')).lower()
+
+    if name == 'gemini':
+        return GeminiBackend(os.getenv('GEMINI_API_KEY'),
+                             model_name=os.getenv('GEMINI_MODEL', 'gemini-2.0-flash-exp'))
+    if name == 'openai':
+        max_tokens = os.getenv('OPENAI_MAX_TOKENS')
+        return OpenAICompatibleBackend(
+            os.getenv('OPENAI_API_KEY') or os.getenv('DEEPSEEK_API_KEY'),
+            base_url=os.getenv('OPENAI_BASE_URL') or None,
+            model_name=os.getenv('OPENAI_MODEL', 'gpt-4o-mini'),
+            max_connections=int(os.getenv('LLM_MAX_CONNECTIONS', '16')),
+            max_tokens=int(max_tokens) if max_tokens else None
+        )
+    if name == 'fake':
+        return FakeBackend(
+            latency=float(os.getenv('FAKE_LLM_LATENCY', '0.5')),
+            tokens_per_second=float(os.getenv('FAKE_LLM_TOKENS_PER_SECOND', '200')),
+            completion_tokens=int(os.getenv('FAKE_LLM_COMPLETION_TOKENS', '600')),
+            error_rate=float(os.getenv('FAKE_LLM_ERROR_RATE', '0'))
+        )
+    raise ValueError(f"Unknown LLM backend: {name}")
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def run_sync(coroutine):
+    """Run a coroutine on the shared background event loop and wait for its result"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='llm-backend-loop', daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coroutine, _loop).result()
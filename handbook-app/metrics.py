@@ -0,0 +1,170 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Optional, Tuple
+
+# Histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+METRIC_PREFIX = "handbook_"
+
+
+class MetricsRegistry:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, trace_path: Optional[str] = None):
+        """Process-wide counters and duration histograms, rendered in Prometheus text format.
+
+        With a ``trace_path`` every finished span is also appended to that file
+        as one JSON object per line. Without one, TRACE_LOG is read when spans
+        finish, so it may be set (e.g. from .env) after this module is imported.
+        """
+        self.buckets = buckets
+        self._trace_path = trace_path
+
+        self._counters: Dict[Tuple[str, tuple], float] = {}
+        self._histograms: Dict[Tuple[str, tuple], Dict] = {}
+        self._lock = threading.Lock()
+        self._trace_lock = threading.Lock()
+
+    @property
+    def trace_path(self) -> Optional[str]:
+        return self._trace_path or os.getenv('TRACE_LOG') or None
+
+    @trace_path.setter
+    def trace_path(self, path: Optional[str]):
+        self._trace_path = path
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Add ``value`` to a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        """Record one duration in a histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram['counts'][i] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    @contextmanager
+    def span(self, name: str, **labels) -> Iterator[Dict]:
+        """Time a block as ``<name>_seconds`` and count failures as ``<name>_errors_total``.
+
+        Yields a dict the block can fill with extra fields (chunk counts,
+        tokens) for the trace log; ``labels`` go on both the metrics and the trace.
+        """
+        fields = {}
+        started = time.perf_counter()
+        status = 'ok'
+        try:
+            yield fields
+        except BaseException as e:
+            # GeneratorExit is a consumer walking away, not a failure
+            if not isinstance(e, GeneratorExit):
+                status = 'error'
+                self.inc(f"{name}_errors_total", **labels)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe(f"{name}_seconds", elapsed, **labels)
+            if self.trace_path:
+                self._trace({'ts': round(time.time(), 3), 'span': name, 'status': status,
+                             'duration_ms': round(elapsed * 1000, 3), **labels, **fields})
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            histograms = [(key, {**value, 'counts': list(value['counts'])}) for key, value in histograms]
+
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f"{METRIC_PREFIX}{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{_labels(labels)} {_number(value)}")
+
+        for (name, labels), histogram in histograms:
+            metric = f"{METRIC_PREFIX}{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} histogram")
+                typed.add(metric)
+            for bound, count in zip(self.buckets, histogram['counts']):
+                lines.append(f"{metric}_bucket{_labels(labels + (('le', _number(bound)),))} {count}")
+            lines.append(f"{metric}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{metric}_sum{_labels(labels)} {histogram['sum']:.6f}")
+            lines.append(f"{metric}_count{_labels(labels)} {histogram['count']}")
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """Drop every recorded value"""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def _trace(self, record: Dict):
+        try:
+            line = json.dumps(record, default=str)
+            with self._trace_lock:
+                with open(self.trace_path, 'a', encoding='utf-8') as f:
+                    f.write(line + "\n")
+        except Exception as e:
+            print(f"Could not write trace record: {e}")
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+registry = MetricsRegistry()
+
+# Module-level shortcuts to the shared registry
+inc = registry.inc
+observe = registry.observe
+span = registry.span
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+    """Serve /metrics on a background thread, beside the Gradio app"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    print(f"📈 Metrics at http://{host}:{port}/metrics")
+    return server
@@ -1,141 +1,760 @@
+import multiprocessing
 import os
-import PyPDF2
-import pdfplumber
-from typing import List, Dict
-import chromadb
-from chromadb.config import Settings
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Optional, Iterable, Iterator
+import metrics
+from bm25_index import BM25Index
+from ingest_cache import IngestCache
+from query_cache import QueryCache, normalize_query
+from result_selection import mmr_select, merge_adjacent
+from text_chunker import SentenceChunker, PAGE_SEPARATOR
+from token_budget import TokenBudget
+
+# PDFs shorter than this are extracted in-process; pool startup would dominate
+PARALLEL_EXTRACT_MIN_PAGES = 32
+
+# Most pages in one pool task, so text in flight stays bounded whatever the document size
+EXTRACT_RANGE_PAGES = 8
+
+# Characters of each document kept for the upload preview
+PREVIEW_CHARS = 500
+
+# Hybrid retrieval ranks this many times k candidates from each side before fusing
+HYBRID_CANDIDATE_FACTOR = 3
+
+# Reciprocal rank fusion damping constant
+RRF_K = 60
+
+# select_context considers this many times k candidates before picking k
+MMR_CANDIDATE_FACTOR = 3
+
+# Chunks fetched per page when reading a whole collection (keyword index rebuild, exports, digests)
+LEXICAL_REBUILD_PAGE_SIZE = 1000
+
+DEFAULT_COLLECTION = "pdf_documents"
+
+
+def _count_pages(pdf_path: str) -> int:
+    """Count pages, trying PyPDF2 first since it does not parse page content"""
+    import PyPDF2
+    import pdfplumber
+
+    try:
+        with open(pdf_path, 'rb') as file:
+            return len(PyPDF2.PdfReader(file).pages)
+    except Exception as e:
+        try:
+            with pdfplumber.open(pdf_path) as pdf:
+                return len(pdf.pages)
+        except Exception:
+            raise Exception(f"Failed to extract text from PDF: {e}")
+
+
+def _iter_page_range(pdf_path: str, start: int, end: int) -> Iterator[str]:
+    """Yield text for pages [start, end) with pdfplumber, falling back to PyPDF2 per page"""
+    import PyPDF2
+    import pdfplumber
+
+    pdf_reader = None
+
+    try:
+        pdf = pdfplumber.open(pdf_path)
+    except Exception as e:
+        print(f"pdfplumber failed: {e}, trying PyPDF2...")
+        pdf = None
+
+    with open(pdf_path, 'rb') as file:
+        try:
+            for page_number in range(start, end):
+                page_text = None
+
+                if pdf is not None:
+                    try:
+                        # Try pdfplumber first (better for complex PDFs)
+                        page = pdf.pages[page_number]
+                        page_text = page.extract_text()
+                        page.close()
+                        yield page_text or ""
+                        continue
+                    except Exception as e:
+                        print(f"pdfplumber failed on page {page_number + 1}: {e}, trying PyPDF2...")
+
+                # Fallback to PyPDF2
+                try:
+                    if pdf_reader is None:
+                        pdf_reader = PyPDF2.PdfReader(file)
+                    page_text = pdf_reader.pages[page_number].extract_text()
+                except Exception as e2:
+                    print(f"PyPDF2 failed on page {page_number + 1}: {e2}, skipping page")
+
+                yield page_text or ""
+        finally:
+            if pdf is not None:
+                pdf.close()
+
+
+def _extract_page_range(pdf_path: str, start: int, end: int) -> List[str]:
+    """Extract pages [start, end); module-level so it can run in a worker process"""
+    return list(_iter_page_range(pdf_path, start, end))
+
+
+def _fuse_rankings(rankings: List[List[Dict]], k: int) -> List[Dict]:
+    """Merge ranked hit lists by reciprocal rank fusion, keeping the top ``k``"""
+    scores = {}
+    hits = {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking):
+            scores[hit['id']] = scores.get(hit['id'], 0.0) + 1.0 / (RRF_K + rank + 1)
+            hits.setdefault(hit['id'], hit)
+
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [{**hits[chunk_id], 'score': scores[chunk_id]} for chunk_id in best]
+
+
+def _format_hit(hit: Dict, rank: int) -> Dict:
+    """Context dict for a search hit"""
+    metadata = hit['metadata'] or {}
+    return {
+        'text': hit['text'],
+        'source': metadata.get('source', 'Unknown'),
+        'chunk_id': metadata.get('chunk_id', rank),
+        'page': metadata.get('page'),
+        'id': hit['id'],
+        'doc_id': metadata.get('doc_id'),
+        'start': metadata.get('start'),
+        'end': metadata.get('end'),
+        'score': hit.get('score')
+    }
+
+
+def _dedupe_across(results: List[List[Dict]]) -> List[List[Dict]]:
+    """Keep each chunk only in the result list where it scored best (earliest list on ties)"""
+    best = {}
+    for i, contexts in enumerate(results):
+        for ctx in contexts:
+            score = ctx.get('score') or 0.0
+            if ctx['id'] not in best or score > best[ctx['id']][0]:
+                best[ctx['id']] = (score, i)
+    return [[ctx for ctx in contexts if best[ctx['id']][1] == i] for i, contexts in enumerate(results)]
+
+
+def _page_chunks(page: Dict) -> Iterator[Dict]:
+    """Chunk dicts from one ``collection.get`` result, with metadata fields when it was fetched"""
+    metadatas = page.get('metadatas') or [None] * len(page['ids'])
+    for chunk_id, doc, metadata in zip(page['ids'], page['documents'], metadatas):
+        chunk = {'id': chunk_id, 'text': doc}
+        if page.get('metadatas') is not None:
+            metadata = metadata or {}
+            chunk.update(source=metadata.get('source', 'Unknown'), page=metadata.get('page'),
+                         doc_id=metadata.get('doc_id'), chunk_id=metadata.get('chunk_id', 0))
+        yield chunk
+
+
+# One long-lived extraction pool per worker count, shared by every processor and upload
+_extract_pools: Dict[int, ProcessPoolExecutor] = {}
+_extract_pools_lock = threading.Lock()
+
+
+def extract_pool(workers: int) -> ProcessPoolExecutor:
+    """The shared page-extraction pool, started on first use.
+
+    Workers are spawned rather than forked: the app process runs many
+    threads, and forking it mid-request is unsafe.
+    """
+    with _extract_pools_lock:
+        pool = _extract_pools.get(workers)
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _extract_pools[workers] = pool
+        return pool
+
+
+def _discard_extract_pool(pool: ProcessPoolExecutor):
+    """Forget a pool whose worker died so the next large PDF starts a fresh one"""
+    with _extract_pools_lock:
+        for workers, known in list(_extract_pools.items()):
+            if known is pool:
+                del _extract_pools[workers]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def create_chroma_client(persist_directory: Optional[str] = None):
+    """ChromaDB client on disk when a directory is given, otherwise in memory"""
+    # ChromaDB takes most of a second to import, so it is loaded on first use
+    import chromadb
+    from chromadb.config import Settings
+
+    settings = Settings(
+        anonymized_telemetry=False,
+        allow_reset=True
+    )
+
+    if persist_directory:
+        os.makedirs(persist_directory, exist_ok=True)
+        return chromadb.PersistentClient(path=persist_directory, settings=settings)
+    return chromadb.Client(settings)
+
+
+def default_embedding_function():
+    """ChromaDB's default sentence embedding model (loaded on first use)"""
+    from chromadb.utils import embedding_functions
+
+    return embedding_functions.DefaultEmbeddingFunction()
 
 
 class PDFProcessor:
-    def __init__(self):
-        """Initialize PDF processor with ChromaDB vector database"""
+    def __init__(self, persist_directory: Optional[str] = None, collection_name: str = DEFAULT_COLLECTION,
+                 client=None, embedding_function=None):
+        """Initialize PDF processor with ChromaDB vector database.
+
+        With a ``persist_directory`` (or CHROMA_PERSIST_DIR) the collection lives
+        on disk and survives restarts; otherwise it is kept in memory. Several
+        processors (one per session) can share a ``client`` and
+        ``embedding_function``, each with its own ``collection_name``.
+        """
+        self.persist_directory = persist_directory or os.getenv('CHROMA_PERSIST_DIR')
+        self.collection_name = collection_name
+
         # Initialize ChromaDB
-        self.chroma_client = chromadb.Client(Settings(
-            anonymized_telemetry=False,
-            allow_reset=True
-        ))
+        self.chroma_client = client or create_chroma_client(self.persist_directory)
+
+        # Held directly so queries can be embedded once and reused by the query cache
+        self.embedding_function = embedding_function or default_embedding_function()
 
         # Create or get collection
         try:
-            self.collection = self.chroma_client.get_collection(name="pdf_documents")
+            self.collection = self.chroma_client.get_collection(
+                name=self.collection_name,
+                embedding_function=self.embedding_function
+            )
         except:
             self.collection = self.chroma_client.create_collection(
-                name="pdf_documents",
-                metadata={"hnsw:space": "cosine"}
+                name=self.collection_name,
+                metadata={"hnsw:space": "cosine"},
+                embedding_function=self.embedding_function
             )
 
+        # Uploads for one processor can run concurrently
         self.doc_counter = 0
+        self._counter_lock = threading.Lock()
 
-    def extract_text_from_pdf(self, pdf_path: str) -> str:
-        """Extract text from PDF file using multiple methods for robustness"""
-        text = ""
+        # Worker processes for page-parallel extraction of large PDFs
+        self.extract_workers = int(os.getenv('PDF_EXTRACT_WORKERS', '0')) or os.cpu_count() or 1
 
-        try:
-            # Try pdfplumber first (better for complex PDFs)
-            with pdfplumber.open(pdf_path) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text += page_text + "\n\n"
-        except Exception as e:
-            print(f"pdfplumber failed: {e}, trying PyPDF2...")
+        # Sentence-aligned chunks sized in estimated tokens
+        self.chunker = SentenceChunker(
+            chunk_tokens=int(os.getenv('CHUNK_TOKENS', '512')),
+            overlap_tokens=int(os.getenv('CHUNK_OVERLAP_TOKENS', '50'))
+        )
 
-            # Fallback to PyPDF2
-            try:
-                with open(pdf_path, 'rb') as file:
-                    pdf_reader = PyPDF2.PdfReader(file)
-                    for page in pdf_reader.pages:
-                        page_text = page.extract_text()
-                        if page_text:
-                            text += page_text + "\n\n"
-            except Exception as e2:
-                raise Exception(f"Failed to extract text from PDF: {e2}")
-
-        if not text.strip():
-            raise Exception("No text could be extracted from the PDF")
-
-        return text.strip()
-
-    def chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-        """Split text into overlapping chunks for better context retrieval"""
-        chunks = []
-        words = text.split()
-
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk = " ".join(words[i:i + chunk_size])
-            if chunk.strip():
-                chunks.append(chunk)
-
-        return chunks
-
-    def add_to_vectordb(self, text: str, source: str):
-        """Add document chunks to vector database"""
-        # Chunk the text
-        chunks = self.chunk_text(text)
-
-        # Prepare data for ChromaDB
-        ids = [f"doc_{self.doc_counter}_chunk_{i}" for i in range(len(chunks))]
-        metadatas = [{"source": source, "chunk_id": i} for i in range(len(chunks))]
-
-        # Add to collection
-        self.collection.add(
-            documents=chunks,
-            metadatas=metadatas,
-            ids=ids
+        # Chunks embedded and inserted per collection.add call
+        self.embed_batch_size = int(os.getenv('EMBED_BATCH_SIZE', '64'))
+
+        # Retrieval results for repeated (or, optionally, near-identical) queries;
+        # invalidated whenever the collection changes
+        similarity = os.getenv('QUERY_CACHE_SIMILARITY')
+        self.query_cache = QueryCache(
+            max_entries=int(os.getenv('QUERY_CACHE_SIZE', '512')),
+            similarity_threshold=float(similarity) if similarity else None
         )
 
-        self.doc_counter += 1
-        print(f"Added {len(chunks)} chunks from {source}")
+        # BM25 keyword index kept alongside the collection for lexical/hybrid retrieval.
+        # A reopened persistent collection is indexed lazily on the first keyword query.
+        self.retrieval_mode = os.getenv('RETRIEVAL_MODE', 'hybrid')
+        self.lexical_index = BM25Index()
 
-    def get_relevant_context(self, query: str, k: int = 5) -> List[Dict]:
-        """Retrieve relevant context from vector database"""
-        try:
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=min(k, self.collection.count())
+        # Weight given to avoiding redundancy (vs. relevance) when selecting context
+        self.mmr_diversity = float(os.getenv('MMR_DIVERSITY', '0.3'))
+        self._lexical_lock = threading.Lock()
+        # Chunks in the collection, kept up to date here so searches need not ask Chroma
+        self.chunk_count = self.collection.count()
+        self._lexical_index_ready = self.chunk_count == 0
+
+        # Selected context is fitted by the same rules as prompt context
+        self.token_budget = TokenBudget()
+
+        # File content hash -> document summary and chunk IDs, so re-uploads are free.
+        # Persisted next to the collection so it stays in step with it.
+        cache_name = "ingest_cache.json" if collection_name == DEFAULT_COLLECTION else f"ingest_cache_{collection_name}.json"
+        cache_path = os.path.join(self.persist_directory, cache_name) if self.persist_directory else None
+        self.ingest_cache = IngestCache(cache_path)
+
+        if self.persist_directory:
+            print(f"Loaded {self.chunk_count} chunks from {self.persist_directory}")
+
+    def track_pages(self, pages: Iterable[str], stats: Dict) -> Iterator[str]:
+        """Pass pages through while filling ``stats`` with page and character counts and a preview"""
+        stats['pages'] = 0
+        stats['chars'] = 0
+        stats['preview'] = ""
+
+        for page_text in pages:
+            metrics.inc('pages_extracted_total')
+            stats['pages'] += 1
+            if page_text:
+                if len(stats['preview']) < PREVIEW_CHARS:
+                    stats['preview'] = (stats['preview'] + page_text)[:PREVIEW_CHARS]
+                stats['chars'] += len(page_text)
+            yield page_text
+
+    def iter_pages(self, pdf_path: str, workers: Optional[int] = None) -> Iterator[str]:
+        """Yield the text of each page in order.
+
+        Large PDFs are split into page ranges and extracted on the shared
+        process pool, with only a few ranges in flight at once; small ones are
+        extracted in-process.
+        """
+        workers = workers or self.extract_workers
+        page_count = _count_pages(pdf_path)
+
+        if workers > 1 and page_count >= PARALLEL_EXTRACT_MIN_PAGES:
+            # A few ranges per worker keeps the pool busy when pages vary in cost; the cap
+            # keeps the in-flight window (workers * 2 ranges) from growing with page count
+            batch = max(1, min(EXTRACT_RANGE_PAGES, -(-page_count // (workers * 4))))
+            ranges = [(start, min(start + batch, page_count)) for start in range(0, page_count, batch)]
+
+            pool = extract_pool(workers)
+            try:
+                yield from self._iter_pool_pages(pool, pdf_path, ranges, workers * 2)
+            except BrokenProcessPool:
+                _discard_extract_pool(pool)
+                raise
+        else:
+            yield from _iter_page_range(pdf_path, 0, page_count)
+
+    def _iter_pool_pages(self, executor: ProcessPoolExecutor, pdf_path: str, ranges: List[tuple],
+                         window: int) -> Iterator[str]:
+        """Extract page ranges on a pool, keeping at most ``window`` ranges in flight"""
+        pending = deque()
+        for start, end in ranges:
+            pending.append(executor.submit(_extract_page_range, pdf_path, start, end))
+            if len(pending) >= window:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+    def extract_text_from_pdf(self, pdf_path: str, workers: Optional[int] = None) -> str:
+        """Extract text from PDF file using multiple methods for robustness.
+
+        Pages are joined with PAGE_SEPARATOR, so chunk offsets index into the
+        returned text.
+        """
+        with metrics.span('extract_text') as fields:
+            stats = {}
+            pages = self.track_pages(self.iter_pages(pdf_path, workers), stats)
+            text = PAGE_SEPARATOR.join(page_text for page_text in pages if page_text)
+            fields['chars'] = stats['chars']
+
+            if not text.strip():
+                raise Exception("No text could be extracted from the PDF")
+
+            return text
+
+    def chunk_text(self, text: str) -> List[str]:
+        """Split text into sentence-aligned chunks for better context retrieval"""
+        return [chunk['text'] for chunk in self.chunker.chunk_text(text)]
+
+    def iter_chunks(self, pages: Iterable[str]) -> Iterator[Dict]:
+        """Yield chunk dicts (text, character offsets, pages) as soon as enough sentences have arrived"""
+        return self.chunker.chunk_pages(pages)
+
+    def add_to_vectordb(self, text: str, source: str) -> List[str]:
+        """Add document chunks to vector database, returning their IDs"""
+        return self.add_chunks_to_vectordb(self.iter_chunks([text]), source)
+
+    def add_chunks_to_vectordb(self, chunks: Iterable[Dict], source: str, batch_size: Optional[int] = None) -> List[str]:
+        """Embed and insert chunks in bounded batches, returning their IDs.
+
+        If the chunk stream fails part-way, chunks already inserted are removed
+        so a retry does not leave duplicates behind.
+        """
+        batch_size = batch_size or self.embed_batch_size
+
+        doc_id = self.new_doc_id()
+        ids = []
+        batch = []
+
+        with metrics.span('add_to_vectordb') as fields:
+            try:
+                for chunk in chunks:
+                    batch.append(chunk)
+                    if len(batch) >= batch_size:
+                        ids.extend(self._add_batch(batch, source, doc_id, len(ids)))
+                        batch = []
+
+                if batch:
+                    ids.extend(self._add_batch(batch, source, doc_id, len(ids)))
+            except Exception:
+                self.delete_chunks(ids)
+                raise
+            fields.update(source=source, chunks=len(ids))
+
+        self.record_document()
+        print(f"Added {len(ids)} chunks from {source}")
+        return ids
+
+    def _add_batch(self, chunks: List[Dict], source: str, doc_id: str, first_chunk: int) -> List[str]:
+        """Insert one batch of chunks for a document"""
+        chunk_numbers = range(first_chunk, first_chunk + len(chunks))
+        ids = [f"{doc_id}_chunk_{i}" for i in chunk_numbers]
+        metadatas = [self.chunk_metadata(chunk, source, doc_id, i) for chunk, i in zip(chunks, chunk_numbers)]
+
+        self.insert_chunks([chunk['text'] for chunk in chunks], metadatas, ids)
+        return ids
+
+    def chunk_metadata(self, chunk: Dict, source: str, doc_id: str, chunk_number: int) -> Dict:
+        """Metadata stored with a chunk: where it came from and where it sits in the document"""
+        return {
+            "source": source,
+            "chunk_id": chunk_number,
+            "doc_id": doc_id,
+            "start": chunk['start'],
+            "end": chunk['end'],
+            "page": chunk['page'],
+            "page_end": chunk['page_end'],
+        }
+
+    def insert_chunks(self, documents: List[str], metadatas: List[Dict], ids: List[str]):
+        """Embed and add one batch of chunks, which may span several documents"""
+        with metrics.span('embed_insert') as fields:
+            self.collection.add(
+                documents=documents,
+                metadatas=metadatas,
+                ids=ids
             )
+            self.lexical_index.add(ids, documents)
+            with self._counter_lock:
+                self.chunk_count += len(ids)
+            self.query_cache.invalidate()
+            fields['chunks'] = len(ids)
 
-            if not results['documents'] or not results['documents'][0]:
-                return []
+        metrics.inc('chunks_indexed_total', len(ids))
+        metrics.inc('chunk_bytes_indexed_total', sum(len(document.encode('utf-8')) for document in documents))
 
-            # Format results
-            contexts = []
-            for i, (doc, metadata) in enumerate(zip(results['documents'][0], results['metadatas'][0])):
-                contexts.append({
-                    'text': doc,
-                    'source': metadata.get('source', 'Unknown'),
-                    'chunk_id': metadata.get('chunk_id', i)
-                })
+    def delete_chunks(self, ids: List[str]):
+        """Remove chunks by ID"""
+        if ids:
+            self.collection.delete(ids=ids)
+            self.lexical_index.remove(ids)
+            # Some IDs may never have been inserted, so recount (deletes are rare)
+            with self._counter_lock:
+                self.chunk_count = self.collection.count()
+            self.query_cache.invalidate()
 
-            return contexts
-        except Exception as e:
-            print(f"Error retrieving context: {e}")
+    def record_document(self):
+        """Count one more indexed document"""
+        with self._counter_lock:
+            self.doc_counter += 1
+
+    def new_doc_id(self) -> str:
+        """Allocate a document ID that cannot collide with earlier runs.
+
+        IDs are random rather than a counter so they stay unique across
+        restarts of a persistent store.
+        """
+        return f"doc_{uuid.uuid4().hex[:16]}"
+
+    def get_relevant_context(self, query: str, k: int = 5, mode: Optional[str] = None) -> List[Dict]:
+        """Retrieve relevant context, reusing cached results for repeated queries.
+
+        ``mode`` is 'vector' (dense search), 'lexical' (BM25 over the inverted
+        index, no embedding model involved) or 'hybrid' (both, fused by
+        reciprocal rank); it defaults to RETRIEVAL_MODE.
+        """
+        return self.get_relevant_contexts([query], k, mode)[0]
+
+    def get_relevant_contexts(self, queries: List[str], k: int = 5, mode: Optional[str] = None,
+                              dedupe: bool = False) -> List[List[Dict]]:
+        """Retrieve context for several queries at once, one result list per query.
+
+        Queries not served from cache are embedded in one call and searched
+        with a single multi-query vector search; repeats within the batch are
+        searched once. Each context carries a 'score' (cosine similarity, BM25
+        score or fused rank score, by mode; higher is better). With ``dedupe``
+        a chunk is kept only for the query it scored best on.
+        """
+        mode = mode or self.retrieval_mode
+        results: List[Optional[List[Dict]]] = [None] * len(queries)
+
+        with metrics.span('retrieve', mode=mode) as fields:
+            # Normalized query -> positions in the batch still needing results
+            pending: Dict[str, List[int]] = {}
+            for i, query in enumerate(queries):
+                cached = self.query_cache.get(query, k, mode)
+                if cached is not None:
+                    metrics.inc('query_cache_total', result='hit')
+                    results[i] = cached
+                else:
+                    pending.setdefault(normalize_query(query), []).append(i)
+
+            if pending:
+                try:
+                    searched = self._search_batch([queries[positions[0]] for positions in pending.values()], k, mode)
+                    for positions, contexts in zip(pending.values(), searched):
+                        for i in positions:
+                            results[i] = contexts
+                except Exception as e:
+                    print(f"Error retrieving context: {e}")
+                    metrics.inc('retrieve_errors_total', mode=mode)
+                    results = [contexts or [] for contexts in results]
+
+            fields.update(queries=len(queries), searched=len(pending),
+                          results=sum(len(contexts) for contexts in results))
+
+        if dedupe:
+            results = _dedupe_across(results)
+        return results
+
+    def _search_batch(self, queries: List[str], k: int, mode: str) -> List[List[Dict]]:
+        """Search uncached queries together, caching each query's results"""
+        generation = self.query_cache.generation
+        results: List[Optional[List[Dict]]] = [None] * len(queries)
+
+        # One embedding call for the whole batch
+        embeddings = [None] * len(queries)
+        if mode != 'lexical':
+            embeddings = list(self.embedding_function(queries))
+
+            if self.query_cache.similarity_threshold:
+                for i, embedding in enumerate(embeddings):
+                    results[i] = self.query_cache.get_similar(embedding, k, mode)
+                    if results[i] is not None:
+                        metrics.inc('query_cache_total', result='similar_hit')
+
+        to_search = [i for i, contexts in enumerate(results) if contexts is None]
+        candidates = k * HYBRID_CANDIDATE_FACTOR if mode == 'hybrid' else k
+        vector_hits = {}
+        if mode != 'lexical' and to_search:
+            searched = self._vector_search_batch([embeddings[i] for i in to_search], candidates)
+            vector_hits = dict(zip(to_search, searched))
+
+        lexical_hits = {}
+        if mode != 'vector' and to_search:
+            # Chunks the vector search already returned are not fetched again
+            known = {hit['id']: hit for hits in vector_hits.values() for hit in hits}
+            searched = self._lexical_search_batch([queries[i] for i in to_search],
+                                                  k if mode == 'lexical' else candidates, known)
+            lexical_hits = dict(zip(to_search, searched))
+
+        for i in to_search:
+            if mode == 'lexical':
+                hits = lexical_hits[i]
+            elif mode == 'hybrid':
+                hits = _fuse_rankings([vector_hits[i], lexical_hits[i]], k)
+            else:
+                hits = vector_hits[i]
+
+            results[i] = [_format_hit(hit, rank) for rank, hit in enumerate(hits)]
+            metrics.inc('query_cache_total', result='miss')
+            embedding = embeddings[i] if self.query_cache.similarity_threshold else None
+            self.query_cache.put(queries[i], k, results[i], embedding, generation, mode)
+
+        return results
+
+    def select_context(self, query: str, k: int = 5, token_budget: Optional[int] = None) -> List[Dict]:
+        """Retrieve ``k`` distinct pieces of context for a prompt.
+
+        Over-fetches candidates, picks a diverse subset by maximal marginal
+        relevance, merges neighbouring chunks of the same document into single
+        spans, and keeps what fits in ``token_budget`` estimated tokens
+        (default: ``k`` full-size chunks), trimming the first span that does
+        not fit as ``TokenBudget.fit`` does.
+        """
+        if token_budget is None:
+            token_budget = k * self.chunker.chunk_tokens
+
+        candidates = self.get_relevant_context(query, k * MMR_CANDIDATE_FACTOR)
+        selected = mmr_select(candidates, k, self.mmr_diversity)
+        return self.token_budget.fit(merge_adjacent(selected), token_budget)
+
+    def select_contexts(self, queries: List[str], ks: List[int], dedupe: bool = False) -> List[List[Dict]]:
+        """``select_context`` for several queries (``ks[i]`` pieces for ``queries[i]``) in one retrieval batch"""
+        if not queries:
             return []
 
+        # One batch at the largest k; each query keeps its own top candidates
+        batch = self.get_relevant_contexts(queries, max(ks) * MMR_CANDIDATE_FACTOR, dedupe=dedupe)
+        return [
+            self.token_budget.fit(merge_adjacent(mmr_select(candidates[:k * MMR_CANDIDATE_FACTOR], k, self.mmr_diversity)),
+                                  k * self.chunker.chunk_tokens)
+            for candidates, k in zip(batch, ks)
+        ]
+
+    def _vector_search_batch(self, embeddings: List, k: int) -> List[List[Dict]]:
+        """Nearest chunks for each query embedding in one query call, as dicts with id, text, metadata and score"""
+        count = self.chunk_count
+        if not count:
+            return [[] for _ in embeddings]
+
+        results = self.collection.query(
+            query_embeddings=embeddings,
+            n_results=min(k, count),
+            include=["documents", "metadatas", "distances"]
+        )
+
+        return [
+            [
+                # Cosine space: similarity is one minus the distance
+                {'id': chunk_id, 'text': doc, 'metadata': metadata, 'score': 1.0 - distance}
+                for chunk_id, doc, metadata, distance in zip(ids, docs, metadatas, distances)
+            ]
+            for ids, docs, metadatas, distances in zip(results['ids'], results['documents'],
+                                                       results['metadatas'], results['distances'])
+        ]
+
+    def _lexical_search_batch(self, queries: List[str], k: int,
+                              known: Optional[Dict[str, Dict]] = None) -> List[List[Dict]]:
+        """Best BM25 matches for each query, as dicts with id, text, metadata and score.
+
+        Chunks not in ``known`` (ID -> hit from another search) are fetched
+        from the collection in a single call for the whole batch.
+        """
+        self._ensure_lexical_index()
+        rankings = [self.lexical_index.search(query, k) for query in queries]
+
+        found = {chunk_id: {'id': chunk_id, 'text': hit['text'], 'metadata': hit['metadata']}
+                 for chunk_id, hit in (known or {}).items()}
+        missing = list(dict.fromkeys(chunk_id for ranked in rankings for chunk_id, _ in ranked
+                                     if chunk_id not in found))
+        if missing:
+            results = self.collection.get(ids=missing, include=["documents", "metadatas"])
+            for chunk_id, doc, metadata in zip(results['ids'], results['documents'], results['metadatas']):
+                found[chunk_id] = {'id': chunk_id, 'text': doc, 'metadata': metadata}
+
+        return [
+            [{**found[chunk_id], 'score': score} for chunk_id, score in ranked if chunk_id in found]
+            for ranked in rankings
+        ]
+
+    def _ensure_lexical_index(self):
+        """Build the inverted index from the collection the first time it is needed.
+
+        Only a reopened persistent store needs this; chunks added in this
+        process are indexed as they are inserted.
+        """
+        with self._lexical_lock:
+            if self._lexical_index_ready:
+                return
+
+            total = 0
+            # Storage order is fine here, and skips the ordering pass
+            for page in self._iter_pages(["documents"]):
+                self.lexical_index.add(page['ids'], page['documents'])
+                total += len(page['ids'])
+
+            self._lexical_index_ready = True
+            if total:
+                print(f"Built keyword index over {total} chunks")
+
     def clear_vectordb(self):
         """Clear the vector database"""
         try:
-            self.chroma_client.delete_collection(name="pdf_documents")
+            self.chroma_client.delete_collection(name=self.collection_name)
             self.collection = self.chroma_client.create_collection(
-                name="pdf_documents",
-                metadata={"hnsw:space": "cosine"}
+                name=self.collection_name,
+                metadata={"hnsw:space": "cosine"},
+                embedding_function=self.embedding_function
             )
-            self.doc_counter = 0
+            self.lexical_index.clear()
+            self._lexical_index_ready = True
+            self.query_cache.invalidate()
+            with self._counter_lock:
+                self.doc_counter = 0
+                self.chunk_count = 0
+            self.ingest_cache.clear()
             print("Vector database cleared")
         except Exception as e:
             print(f"Error clearing database: {e}")
 
-    def get_all_text(self) -> str:
-        """Get all text from the database (for comprehensive handbook generation)"""
+    def delete_collection(self):
+        """Remove this processor's collection and ingest record for good (e.g. when its session ends)"""
         try:
-            # Get all documents
-            all_docs = self.collection.get()
+            self.chroma_client.delete_collection(name=self.collection_name)
+        except Exception as e:
+            print(f"Error deleting collection {self.collection_name}: {e}")
+
+        self.lexical_index.clear()
+        with self._counter_lock:
+            self.chunk_count = 0
+        self.query_cache.invalidate()
+        self.ingest_cache.clear()
+        if self.ingest_cache.path and os.path.exists(self.ingest_cache.path):
+            os.remove(self.ingest_cache.path)
+
+    def iter_documents(self, page_size: Optional[int] = None, include_metadata: bool = True,
+                       ordered: bool = True) -> Iterator[Dict]:
+        """Stream every stored chunk, ``page_size`` at a time, in constant memory.
 
-            if not all_docs['documents']:
-                return ""
+        Yields {'id', 'text'} plus 'source', 'page', 'doc_id' and 'chunk_id'
+        when ``include_metadata`` is set. ``ordered`` yields by source, then
+        document, then chunk number: a first pass reads only metadata to find
+        each document's chunk range, then chunks are fetched in chunk-number
+        windows. Unordered iteration follows storage order in a single pass.
+        Pages are read with limit/offset, so writes made during iteration may
+        or may not be seen.
+        """
+        page_size = page_size or LEXICAL_REBUILD_PAGE_SIZE
+        include = ["documents", "metadatas"] if include_metadata else ["documents"]
 
+        if not ordered:
+            for page in self._iter_pages(include, page_size):
+                yield from _page_chunks(page)
+            return
+
+        # doc_id -> (source, highest chunk number); one small entry per document
+        documents = {}
+        unplaced = []
+        for page in self._iter_pages(["metadatas"], page_size):
+            for chunk_id, metadata in zip(page['ids'], page['metadatas']):
+                metadata = metadata or {}
+                doc_id = metadata.get('doc_id')
+                if doc_id is None or not isinstance(metadata.get('chunk_id'), int):
+                    unplaced.append(chunk_id)
+                    continue
+                source, last = documents.get(doc_id, (metadata.get('source', 'Unknown'), 0))
+                documents[doc_id] = (source, max(last, metadata['chunk_id']))
+
+        for doc_id in sorted(documents, key=lambda doc_id: (documents[doc_id][0], doc_id)):
+            for start in range(0, documents[doc_id][1] + 1, page_size):
+                page = self.collection.get(
+                    where={"$and": [{"doc_id": doc_id},
+                                    {"chunk_id": {"$gte": start}},
+                                    {"chunk_id": {"$lt": start + page_size}}]},
+                    include=["documents", "metadatas"]
+                )
+                chunks = sorted(_page_chunks(page), key=lambda chunk: chunk['chunk_id'])
+                if not include_metadata:
+                    chunks = [{'id': chunk['id'], 'text': chunk['text']} for chunk in chunks]
+                yield from chunks
+
+        # Chunks stored without document metadata have no place in the order; they come last
+        for start in range(0, len(unplaced), page_size):
+            yield from _page_chunks(self.collection.get(ids=unplaced[start:start + page_size], include=include))
+
+    def _iter_pages(self, include: List[str], page_size: int = LEXICAL_REBUILD_PAGE_SIZE) -> Iterator[Dict]:
+        """Raw ``collection.get`` results, one page at a time in storage order"""
+        offset = 0
+        while True:
+            page = self.collection.get(limit=page_size, offset=offset, include=include)
+            if not page['ids']:
+                return
+            yield page
+            if len(page['ids']) < page_size:
+                return
+            offset += page_size
+
+    def get_all_text(self) -> str:
+        """Get all text from the database (for comprehensive handbook generation).
+
+        Builds one string; use ``iter_documents`` to stream large collections.
+        """
+        try:
             # Combine all chunks
-            return "\n\n".join(all_docs['documents'])
+            return "\n\n".join(chunk['text'] for chunk in self.iter_documents(include_metadata=False))
         except Exception as e:
             print(f"Error getting all text: {e}")
             return ""
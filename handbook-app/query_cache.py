@@ -0,0 +1,109 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional, Sequence
+
+import numpy as np
+
+_WHITESPACE_RE = re.compile(r'\s+')
+# Punctuation the keyword tokenizer ignores: everything except the separators it
+# keeps inside joined identifiers such as "pn-1234" or "v2.1"
+_PUNCTUATION_RE = re.compile(r'(?<![a-z0-9])[^\w\s]+|[^\w\s]+(?![a-z0-9])|[^\w\s./-]+|[./-]{2,}')
+
+
+def normalize_query(query: str) -> str:
+    """Fold case, spacing and stray punctuation so trivially different queries match.
+
+    Separators inside identifiers are kept, since keyword retrieval indexes
+    "PN-1234" whole but "PN 1234" as two terms.
+
+    >>> normalize_query('What is RAG') == normalize_query('what is RAG?')
+    True
+    >>> normalize_query('PN-1234 seal') == normalize_query('PN 1234 seal')
+    False
+    """
+    return _WHITESPACE_RE.sub(" ", _PUNCTUATION_RE.sub(" ", query.lower())).strip()
+
+
+class QueryCache:
+    def __init__(self, max_entries: int = 512, similarity_threshold: Optional[float] = None):
+        """LRU cache of retrieval results keyed by normalized query, k and retrieval mode.
+
+        With a ``similarity_threshold``, a query whose embedding has at least
+        that cosine similarity to a cached query's embedding reuses its results.
+        Call ``invalidate`` whenever the collection changes.
+        """
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+
+        self._entries: "OrderedDict[tuple, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'similar_hits': 0, 'misses': 0}
+        self.generation = 0
+
+    def get(self, query: str, k: int, mode: str = 'vector') -> Optional[List[Dict]]:
+        """Results for an exact normalized query, if cached"""
+        key = (normalize_query(query), k, mode)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return list(entry['results'])
+
+    def get_similar(self, embedding: Sequence[float], k: int, mode: str = 'vector') -> Optional[List[Dict]]:
+        """Results for the most similar cached query above the threshold, if any"""
+        if not self.similarity_threshold:
+            return None
+
+        vector = _unit(embedding)
+        with self._lock:
+            best_key, best_score = None, self.similarity_threshold
+            for key, entry in self._entries.items():
+                if key[1:] != (k, mode) or entry['embedding'] is None:
+                    continue
+                score = float(np.dot(vector, entry['embedding']))
+                if score >= best_score:
+                    best_key, best_score = key, score
+
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            self._stats['similar_hits'] += 1
+            return list(self._entries[best_key]['results'])
+
+    def put(self, query: str, k: int, results: List[Dict], embedding: Optional[Sequence[float]] = None,
+            generation: Optional[int] = None, mode: str = 'vector'):
+        """Cache results for a query that missed, unless the collection changed since ``generation`` was read"""
+        with self._lock:
+            self._stats['misses'] += 1
+            if generation is not None and generation != self.generation:
+                return
+
+            key = (normalize_query(query), k, mode)
+            self._entries[key] = {
+                'results': list(results),
+                'embedding': _unit(embedding) if embedding is not None else None,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """Drop every entry; results computed before this call will not be cached"""
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            return {**self._stats, 'entries': len(self._entries)}
+
+
+def _unit(embedding: Sequence[float]) -> np.ndarray:
+    """Normalize an embedding so a dot product is cosine similarity"""
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
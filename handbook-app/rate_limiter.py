@@ -0,0 +1,134 @@
+import os
+import random
+import re
+import threading
+import time
+from typing import Callable, Dict, TypeVar
+
+T = TypeVar('T')
+
+# Server-suggested wait in Gemini errors, e.g. "retryDelay': '27s'" or "retry in 27.5s"
+_RETRY_HINT_RE = re.compile(r"retry(?:Delay'?:\s*'|\s+in\s+)(\d+(?:\.\d+)?)s", re.IGNORECASE)
+# Only a status leading the message counts; numbers elsewhere may be request details
+_STATUS_RE = re.compile(r'^\s*(429|5\d\d)\b')
+_RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+_RETRYABLE_MARKERS = ('resource_exhausted', 'rate limit', 'unavailable', 'overloaded')
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether an API error is a rate limit or transient server failure worth retrying.
+
+    An HTTP status carried by the error decides on its own; the message is
+    only inspected for errors without one.
+    """
+    codes = [getattr(error, name, None) for name in ('status_code', 'code')]
+    statuses = [code for code in codes if isinstance(code, int)]
+    if statuses:
+        return statuses[0] in _RETRYABLE_STATUSES
+    if any(codes):
+        # Named codes such as RESOURCE_EXHAUSTED or rate_limit_exceeded
+        names = " ".join(str(code).lower() for code in codes if code)
+        return any(marker in names or marker in names.replace('_', ' ') for marker in _RETRYABLE_MARKERS)
+
+    message = str(error).lower()
+    return bool(_STATUS_RE.match(message)) or any(marker in message for marker in _RETRYABLE_MARKERS)
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        """Bucket holding up to a minute's allowance, refilled continuously (unlimited if 0)"""
+        self.unlimited = per_minute <= 0
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` is available (0 if it is now)"""
+        if self.unlimited:
+            return 0.0
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        if self.unlimited:
+            return
+        self.level -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float,
+                 max_retries: int = 4, base_delay: float = 1.0, max_delay: float = 60.0):
+        """Client-side throttle on requests/min and tokens/min, with retry on 429/5xx.
+
+        Callers block until both buckets allow the request, so concurrent
+        threads share the quota smoothly instead of bursting past it.
+        """
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int = 0):
+        """Block until one request of ``tokens`` estimated tokens fits the quota"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+                if wait <= 0:
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    return
+            time.sleep(wait)
+
+    def call(self, fn: Callable[[], T], tokens: int = 0) -> T:
+        """Run ``fn`` under the limiter, retrying retryable errors with jittered exponential backoff"""
+        attempt = 0
+        while True:
+            self.acquire(tokens)
+            try:
+                return fn()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+
+                delay = self._backoff(attempt, e)
+                attempt += 1
+                print(f"   ↻ Retry {attempt}/{self.max_retries} in {delay:.1f}s: {str(e)[:100]}")
+                time.sleep(delay)
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """Full-jitter exponential delay, never shorter than the server's hint"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        hint = _RETRY_HINT_RE.search(str(error))
+        if hint:
+            delay = max(delay, min(self.max_delay, float(hint.group(1))))
+        return delay
+
+
+# Free-tier Gemini quota; other backends are unthrottled unless configured
+_DEFAULT_LIMITS = {'gemini': ('15', '1000000')}
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(backend: str = 'gemini') -> RateLimiter:
+    """Process-wide limiter shared by every call to one backend, configured from the environment.
+
+    Limits come from ``<BACKEND>_RPM`` and ``<BACKEND>_TPM`` (e.g. GEMINI_RPM); 0 means unlimited.
+    """
+    with _limiters_lock:
+        if backend not in _limiters:
+            default_rpm, default_tpm = _DEFAULT_LIMITS.get(backend, ('0', '0'))
+            prefix = backend.upper()
+            _limiters[backend] = RateLimiter(
+                requests_per_minute=float(os.getenv(f'{prefix}_RPM', default_rpm)),
+                tokens_per_minute=float(os.getenv(f'{prefix}_TPM', default_tpm)),
+                max_retries=int(os.getenv('LLM_MAX_RETRIES', '4'))
+            )
+        return _limiters[backend]
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 86400,
+                 disk_dir: Optional[str] = None, disk_max_entries: int = 2048):
+        """Two-tier cache of LLM responses: an in-memory LRU and an optional on-disk tier.
+
+        Both tiers evict by size and by age (``ttl_seconds``).
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+        self._disk_count = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_count = len([name for name in os.listdir(disk_dir) if name.endswith('.json')])
+
+    @staticmethod
+    def make_key(model: str, prompt: str) -> str:
+        """Key a prompt by model name and a whitespace-normalized hash of its text"""
+        normalized = _WHITESPACE_RE.sub(" ", prompt).strip()
+        return hashlib.sha256(f"{model}\0{normalized}".encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a cached response, checking memory before disk"""
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created = entry
+                if now - created <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return value
+                del self._memory[key]
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is not None:
+                # Promote to memory for the next lookup
+                self._remember(key, entry['value'], entry['created'])
+                self._stats['disk_hits'] += 1
+                return entry['value']
+
+            self._stats['misses'] += 1
+            return None
+
+    def put(self, key: str, value: str):
+        """Store a response in both tiers"""
+        created = time.time()
+        with self._lock:
+            self._remember(key, value, created)
+        self._write_disk(key, value, created)
+
+    def clear(self):
+        """Empty both tiers"""
+        with self._lock:
+            self._memory.clear()
+
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                if name.endswith('.json'):
+                    self._remove(os.path.join(self.disk_dir, name))
+            self._disk_count = 0
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current sizes"""
+        with self._lock:
+            return {**self._stats, 'memory_entries': len(self._memory), 'disk_entries': self._disk_count}
+
+    def _remember(self, key: str, value: str, created: float):
+        """Insert into the memory tier (caller holds the lock)"""
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key: str, now: float) -> Optional[Dict]:
+        """Load an entry from disk, dropping it if expired"""
+        if not self.disk_dir:
+            return None
+
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Could not read cached response {path}: {e}")
+            return None
+
+        if now - entry['created'] > self.ttl_seconds:
+            self._remove(path)
+            return None
+        return entry
+
+    def _write_disk(self, key: str, value: str, created: float):
+        """Persist an entry, pruning the oldest files once over the size limit"""
+        if not self.disk_dir:
+            return
+
+        path = self._path(key)
+        try:
+            existed = os.path.exists(path)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'created': created, 'value': value}, f)
+            os.replace(tmp_path, path)
+            if not existed:
+                self._disk_count += 1
+        except Exception as e:
+            print(f"Could not write cached response {path}: {e}")
+            return
+
+        if self._disk_count > self.disk_max_entries:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Delete the oldest tenth of the disk tier"""
+        paths = [os.path.join(self.disk_dir, name) for name in os.listdir(self.disk_dir) if name.endswith('.json')]
+        paths.sort(key=lambda path: os.path.getmtime(path))
+
+        excess = len(paths) - self.disk_max_entries
+        for path in paths[:max(excess, self.disk_max_entries // 10)]:
+            self._remove(path)
+        self._disk_count = len([name for name in os.listdir(self.disk_dir) if name.endswith('.json')])
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+            self._disk_count = max(0, self._disk_count - 1)
+        except OSError:
+            pass
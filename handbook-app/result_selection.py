@@ -0,0 +1,84 @@
+from typing import List, Dict
+
+from bm25_index import tokenize
+
+
+def mmr_select(candidates: List[Dict], k: int, diversity: float = 0.3) -> List[Dict]:
+    """Pick ``k`` candidates by maximal marginal relevance.
+
+    Candidates arrive best first, so relevance is taken from rank (scores from
+    vector and keyword search are not comparable). Redundancy is the word
+    overlap (Jaccard) with the closest chunk already picked.
+    """
+    if len(candidates) <= 1:
+        return candidates[:k]
+
+    count = len(candidates)
+    relevance = [1.0 - i / count for i in range(count)]
+    terms = [set(tokenize(candidate['text'])) for candidate in candidates]
+
+    selected = []
+    redundancy = [0.0] * count
+    remaining = set(range(count))
+
+    while remaining and len(selected) < k:
+        best = max(remaining, key=lambda i: (1 - diversity) * relevance[i] - diversity * redundancy[i])
+        selected.append(best)
+        remaining.discard(best)
+
+        for i in remaining:
+            union = len(terms[i] | terms[best])
+            if union:
+                redundancy[i] = max(redundancy[i], len(terms[i] & terms[best]) / union)
+
+    return [candidates[i] for i in selected]
+
+
+def merge_adjacent(contexts: List[Dict]) -> List[Dict]:
+    """Merge chunks that sit next to each other in the same document into one span.
+
+    Overlapping text between neighbours is kept once. Spans keep the position
+    of their best-ranked chunk and list every chunk ID in ``ids``.
+    """
+    spans = []
+    by_document = {}
+
+    for rank, ctx in enumerate(contexts):
+        if ctx.get('doc_id') is None or ctx.get('start') is None:
+            spans.append((rank, [ctx]))
+            continue
+        by_document.setdefault(ctx['doc_id'], []).append((rank, ctx))
+
+    for members in by_document.values():
+        members.sort(key=lambda member: member[1]['chunk_id'])
+        group = [members[0]]
+        for member in members[1:]:
+            if member[1]['chunk_id'] == group[-1][1]['chunk_id'] + 1:
+                group.append(member)
+            else:
+                spans.append((min(rank for rank, _ in group), [ctx for _, ctx in group]))
+                group = [member]
+        spans.append((min(rank for rank, _ in group), [ctx for _, ctx in group]))
+
+    spans.sort(key=lambda span: span[0])
+    return [_join_span(chunks) for _, chunks in spans]
+
+
+def _join_span(chunks: List[Dict]) -> Dict:
+    """Combine consecutive chunks, dropping text the next chunk repeats"""
+    text = chunks[0]['text']
+    end = chunks[0].get('end')
+
+    for chunk in chunks[1:]:
+        if end is not None and chunk.get('start') is not None and chunk['start'] < end:
+            text += chunk['text'][end - chunk['start']:]
+        else:
+            text += "\n" + chunk['text']
+        end = chunk.get('end')
+
+    return {
+        **chunks[0],
+        'text': text,
+        'end': end,
+        'ids': [chunk_id for chunk in chunks for chunk_id in chunk.get('ids', [chunk.get('id')])],
+    }
@@ -0,0 +1,242 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Iterator, Optional
+
+from pdf_processor import PDFProcessor, create_chroma_client, default_embedding_function
+
+# Per-session collections are named with this prefix plus the session ID
+SESSION_COLLECTION_PREFIX = "session_"
+
+# With a persist directory, session IDs and when each was last used are recorded here
+SESSION_REGISTRY = "sessions.json"
+
+
+class Session:
+    def __init__(self, session_id: str, processor: PDFProcessor):
+        """One user's documents: their own collection and upload list"""
+        self.session_id = session_id
+        self.processor = processor
+        self.processed_docs: List[Dict] = []
+        self.last_used = time.monotonic()
+        self.active = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def busy(self):
+        """Mark the session in use; busy sessions are never evicted"""
+        with self._lock:
+            self.active += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.last_used = time.monotonic()
+
+    def select_context(self, query: str, k: int = 5) -> List[Dict]:
+        """Retrieve from this session's documents, keeping it alive (used by background jobs)"""
+        with self.busy():
+            return self.processor.select_context(query, k)
+
+    def select_contexts(self, queries: List[str], ks: List[int]) -> List[List[Dict]]:
+        """Batched ``select_context`` over this session's documents"""
+        with self.busy():
+            return self.processor.select_contexts(queries, ks)
+
+    def iter_chunks(self) -> Iterator[Dict]:
+        """Stream every chunk in this session's collection, keeping the session alive meanwhile"""
+        with self.busy():
+            yield from self.processor.iter_documents()
+
+
+class SessionManager:
+    def __init__(self, isolated: Optional[bool] = None, idle_seconds: Optional[float] = None,
+                 max_sessions: Optional[int] = None, persist_directory: Optional[str] = None):
+        """Hands each user session its own collection, all sharing one ChromaDB client and embedder.
+
+        Sessions idle for ``idle_seconds`` are evicted along with their
+        collection, and at most ``max_sessions`` are kept (least recently used
+        go first). With isolation off every caller shares one collection.
+
+        With a ``persist_directory`` session collections stay on disk and are
+        reopened after a restart until they expire, so background jobs can
+        resume against their documents.
+
+        Session IDs should be durable (a logged-in user or a browser-stored
+        ID) so that, with a persist directory, a user finds their documents
+        again after a reload or restart.
+        """
+        self.persist_directory = persist_directory or os.getenv('CHROMA_PERSIST_DIR')
+        if isolated is None:
+            isolated = os.getenv('SESSION_ISOLATION', 'on').lower() not in ('0', 'off', 'false', 'no')
+        self.isolated = isolated
+        self.idle_seconds = idle_seconds or float(os.getenv('SESSION_IDLE_SECONDS', '3600'))
+        self.max_sessions = max_sessions or int(os.getenv('SESSION_MAX', '100'))
+
+        self.client = create_chroma_client(self.persist_directory)
+        self.embedding_function = default_embedding_function()
+
+        # Used when isolation is off, or when a request carries no session
+        self.shared = Session('shared', self._new_processor(None))
+
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.isolated:
+            self._restore_sessions()
+            threading.Thread(target=self._evict_periodically, name='session-evictor', daemon=True).start()
+
+    def get(self, session_id: Optional[str]) -> Session:
+        """The session for ``session_id``, created on first use"""
+        if not self.isolated or not session_id:
+            self.shared.last_used = time.monotonic()
+            return self.shared
+
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = Session(session_id, self._new_processor(session_id))
+                self._sessions[session_id] = session
+                print(f"👤 New session {session_id[:8]} ({len(self._sessions)} active)")
+                self._save_registry()
+
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            evicted = self._pop_evictable(keep=session_id)
+
+        self._drop(evicted)
+        return session
+
+    def find(self, session_id: Optional[str]) -> Optional[Session]:
+        """The live session for ``session_id`` without creating one, or None if it has ended"""
+        if session_id == self.shared.session_id:
+            return self.shared
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def close(self, session_id: str):
+        """End a session now, deleting its documents"""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._drop([session])
+
+    def evict_idle(self) -> int:
+        """Evict sessions past the idle timeout; returns how many were evicted"""
+        with self._lock:
+            evicted = self._pop_evictable()
+        self._drop(evicted)
+        return len(evicted)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _new_processor(self, session_id: Optional[str]) -> PDFProcessor:
+        kwargs = {}
+        if session_id:
+            kwargs['collection_name'] = _collection_name(session_id)
+        return PDFProcessor(self.persist_directory, client=self.client,
+                            embedding_function=self.embedding_function, **kwargs)
+
+    def _pop_evictable(self, keep: Optional[str] = None) -> List[Session]:
+        """Remove idle and over-limit sessions from the table (caller holds the lock).
+
+        ``keep`` is the session about to be handed out and is never evicted; if
+        every other session is busy the table stays over ``max_sessions``.
+        """
+        now = time.monotonic()
+        evicted = []
+
+        # Least recently used first; sessions with work in flight are kept
+        for session_id, session in list(self._sessions.items()):
+            if session.active or session_id == keep:
+                continue
+            idle = now - session.last_used >= self.idle_seconds
+            if idle or len(self._sessions) > self.max_sessions:
+                evicted.append(self._sessions.pop(session_id))
+        return evicted
+
+    def _drop(self, sessions: List[Session]):
+        """Delete evicted sessions' collections, outside the lock"""
+        for session in sessions:
+            session.processor.delete_collection()
+            print(f"👋 Evicted session {session.session_id[:8]}")
+        if sessions:
+            with self._lock:
+                self._save_registry()
+
+    def _restore_sessions(self):
+        """Reopen session collections a previous run left on disk; delete expired or unknown ones"""
+        if not self.persist_directory:
+            return
+
+        try:
+            last_used = self._load_registry()
+            now = time.time()
+            live = {_collection_name(session_id): session_id for session_id, used in last_used.items()
+                    if now - used < self.idle_seconds}
+
+            for collection in self.client.list_collections():
+                name = getattr(collection, 'name', collection)
+                if name.startswith(SESSION_COLLECTION_PREFIX) and name not in live:
+                    self.client.delete_collection(name=name)
+                    cache_path = os.path.join(self.persist_directory, f"ingest_cache_{name}.json")
+                    if os.path.exists(cache_path):
+                        os.remove(cache_path)
+
+            # Oldest first, so the table keeps least-recently-used order
+            for session_id in sorted(live.values(), key=last_used.get):
+                session = Session(session_id, self._new_processor(session_id))
+                session.last_used = time.monotonic() - (now - last_used[session_id])
+                self._sessions[session_id] = session
+
+            with self._lock:
+                self._save_registry()
+            if self._sessions:
+                print(f"👤 Restored {len(self._sessions)} session(s) from {self.persist_directory}")
+        except Exception as e:
+            print(f"Could not restore sessions: {e}")
+
+    def _load_registry(self) -> Dict[str, float]:
+        path = os.path.join(self.persist_directory, SESSION_REGISTRY)
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_registry(self):
+        """Record live sessions and when each was last used, as wall-clock time (caller holds the lock)"""
+        if not self.persist_directory:
+            return
+
+        now, clock = time.time(), time.monotonic()
+        registry = {session_id: now - (clock - session.last_used) for session_id, session in self._sessions.items()}
+        path = os.path.join(self.persist_directory, SESSION_REGISTRY)
+        try:
+            with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+                json.dump(registry, f)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            print(f"Could not save session registry: {e}")
+
+    def _evict_periodically(self):
+        interval = max(1.0, min(60.0, self.idle_seconds / 4))
+        while True:
+            time.sleep(interval)
+            try:
+                self.evict_idle()
+                with self._lock:
+                    self._save_registry()
+            except Exception as e:
+                print(f"Session eviction failed: {e}")
+
+
+def _collection_name(session_id: str) -> str:
+    """Chroma-safe collection name for a session"""
+    safe = re.sub(r'[^A-Za-z0-9_-]', '', session_id)[:48].rstrip('_-') or 'anonymous'
+    return f"{SESSION_COLLECTION_PREFIX}{safe}"
@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Callable, Iterable, Iterator, Optional, Tuple, Union
+
+import metrics
+from text_chunker import estimate_tokens
+
+MAP_PROMPT = """Condense the following excerpts from source documents into structured notes for a handbook writer.
+
+List, under these headings, everything substantive the excerpts state:
+- Key concepts and definitions
+- Facts, figures and dates
+- Procedures, methods and examples
+- Problems, limitations and open questions
+
+Keep each point short and end it with its citation in brackets, e.g. [manual.pdf, p. 4]. Do not add anything the excerpts do not say.
+
+EXCERPTS:
+{excerpts}"""
+
+REDUCE_PROMPT = """Merge the following notes, taken from consecutive parts of a document collection, into one source digest.
+
+Keep the same four headings (Key concepts and definitions; Facts, figures and dates; Procedures, methods and examples; Problems, limitations and open questions). Remove duplicates, group related points, and keep every citation. Stay under about {target_tokens} tokens.
+
+NOTES:
+{notes}"""
+
+
+def corpus_fingerprint(chunks: Iterable[Dict], model_name: Optional[str] = None) -> str:
+    """Hash of the chunk IDs (or texts, if unidentified) a digest is built from.
+
+    Merged spans list every member chunk in ``ids``, so a span that gains or
+    loses neighbours changes the fingerprint.
+    """
+    return _fingerprint(chunks, model_name)[0]
+
+
+def _fingerprint(chunks: Iterable[Dict], model_name: Optional[str]) -> Tuple[str, int]:
+    """Fingerprint and chunk count in one pass, without holding the chunks.
+
+    Per-key hashes are summed, so the result does not depend on the order
+    chunks arrive in.
+    """
+    total = 0
+    count = 0
+    for chunk in chunks:
+        count += 1
+        for key in chunk.get('ids') or [chunk.get('id') or hashlib.sha256(chunk['text'].encode('utf-8')).hexdigest()]:
+            total += int.from_bytes(hashlib.sha256(key.encode('utf-8')).digest(), 'big')
+    keys = f"{total % (1 << 256):064x}"
+    return hashlib.sha256(json.dumps([model_name, keys]).encode('utf-8')).hexdigest(), count
+
+
+class SourceDigest:
+    def __init__(self, generate: Callable[[str], str], model_name: Optional[str] = None,
+                 cache_dir: Optional[str] = None, map_tokens: int = 6000, target_tokens: int = 4000,
+                 max_workers: int = 4, max_memory_entries: int = 8):
+        """Condenses source chunks into a compact, cited digest by map-reduce over the LLM.
+
+        Chunks are packed into groups of about ``map_tokens`` and summarized by
+        parallel map calls; one reduce call merges the notes. Digests are cached
+        by corpus fingerprint in a small in-memory LRU (``max_memory_entries``)
+        and in ``cache_dir``, so an unchanged corpus is never condensed twice.
+        """
+        self.generate = generate
+        self.model_name = model_name
+        self.cache_dir = cache_dir
+        self.map_tokens = map_tokens
+        self.target_tokens = target_tokens
+        self.max_workers = max_workers
+
+        self.max_memory_entries = max_memory_entries
+
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def build(self, chunks: Union[List[Dict], Callable[[], Iterable[Dict]]]) -> Optional[str]:
+        """Digest of ``chunks`` ({'text', 'source', 'page', 'id'}), from cache when the corpus is unchanged.
+
+        ``chunks`` is a list, or a callable returning a fresh iterator over
+        them (e.g. ``PDFProcessor.iter_documents``). A callable is read once
+        for the fingerprint and, only on a cache miss, once more for the map
+        calls, so a whole collection is never held in memory.
+        """
+        read = chunks if callable(chunks) else lambda: chunks
+
+        key, count = _fingerprint(read(), self.model_name)
+        if not count:
+            return None
+
+        cached = self._load(key)
+        if cached is not None:
+            metrics.inc('digest_cache_total', result='hit')
+            return cached
+        metrics.inc('digest_cache_total', result='miss')
+
+        with metrics.span('source_digest') as fields:
+            print(f"🗜️  Condensing {count} chunks...")
+            stats = {'input_tokens': 0}
+            notes = []
+
+            # Groups are packed as chunks stream in, with a few map calls in flight
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                pending = deque()
+                for group in self._pack(read(), stats):
+                    pending.append(executor.submit(self._map, group))
+                    if len(pending) >= self.max_workers * 2:
+                        notes.append(pending.popleft().result())
+                notes.extend(future.result() for future in pending)
+
+            digest = self._reduce(notes)
+            fields.update(chunks=count, map_calls=len(notes), input_tokens=stats['input_tokens'],
+                          digest_tokens=estimate_tokens(digest))
+
+        self._store(key, digest)
+        print(f"   ✓ Source digest: {estimate_tokens(digest)} tokens")
+        return digest
+
+    def _pack(self, chunks: Iterable[Dict], stats: Dict) -> Iterator[List[Dict]]:
+        """Yield consecutive chunks in groups of up to ``map_tokens`` estimated tokens, totalling tokens in ``stats``"""
+        group = []
+        used = 0
+        for chunk in chunks:
+            tokens = estimate_tokens(chunk['text'])
+            stats['input_tokens'] += tokens
+            if group and used + tokens > self.map_tokens:
+                yield group
+                group = []
+                used = 0
+            group.append(chunk)
+            used += tokens
+        if group:
+            yield group
+
+    def _map(self, group: List[Dict]) -> str:
+        excerpts = "\n\n".join(f"[{cite(chunk)}]\n{chunk['text']}" for chunk in group)
+        return self.generate(MAP_PROMPT.format(excerpts=excerpts))
+
+    def _reduce(self, notes: List[str]) -> str:
+        """Merge map notes; only a very large corpus needs more than one round"""
+        if len(notes) == 1:
+            return notes[0]
+
+        # Merge in batches that fit a map-sized prompt until one call can take the rest
+        while sum(estimate_tokens(note) for note in notes) > self.map_tokens * 2 and len(notes) > 2:
+            batches = [notes[i:i + 4] for i in range(0, len(notes), 4)]
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                notes = list(executor.map(self._merge, batches))
+
+        return self._merge(notes)
+
+    def _merge(self, notes: List[str]) -> str:
+        if len(notes) == 1:
+            return notes[0]
+        joined = "\n\n---\n\n".join(notes)
+        return self.generate(REDUCE_PROMPT.format(notes=joined, target_tokens=self.target_tokens))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        if not self.cache_dir or not os.path.exists(self._path(key)):
+            return None
+        try:
+            with open(self._path(key), 'r', encoding='utf-8') as f:
+                digest = json.load(f)['digest']
+        except Exception as e:
+            print(f"Could not read cached digest {key[:12]}: {e}")
+            return None
+
+        with self._lock:
+            self._remember(key, digest)
+        return digest
+
+    def _remember(self, key: str, digest: str):
+        """Keep a digest in memory, evicting the least recently used (caller holds the lock)"""
+        self._memory[key] = digest
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _store(self, key: str, digest: str):
+        with self._lock:
+            self._remember(key, digest)
+        if not self.cache_dir:
+            return
+
+        try:
+            tmp_path = f"{self._path(key)}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'digest': digest}, f)
+            os.replace(tmp_path, self._path(key))
+        except Exception as e:
+            print(f"Could not cache digest {key[:12]}: {e}")
+
+
+def cite(chunk: Dict) -> str:
+    """Label a context chunk with its source and, when known, its page"""
+    if chunk.get('page'):
+        return f"{chunk.get('source', 'Unknown')}, p. {chunk['page']}"
+    return chunk.get('source', 'Unknown')
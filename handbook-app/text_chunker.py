@@ -0,0 +1,170 @@
+import re
+from typing import List, Dict, Iterable, Iterator
+
+# Sentence ends, or a blank line between paragraphs
+_BOUNDARY_RE = re.compile(r'(?<=[.!?])["\')\]]*\s+(?=["\'(\[]?[A-Z0-9])|\n\s*\n')
+_PARAGRAPH_RE = re.compile(r'\n\s*\n')
+
+# Separator placed between pages when they are joined into one document
+PAGE_SEPARATOR = "\n\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return (len(text) + 3) // 4
+
+
+class SentenceChunker:
+    def __init__(self, chunk_tokens: int = 512, overlap_tokens: int = 50):
+        """Split page text into chunks that end on sentence or paragraph boundaries.
+
+        Chunks target ``chunk_tokens`` estimated tokens and repeat up to
+        ``overlap_tokens`` worth of trailing sentences from the previous chunk.
+        """
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def chunk_pages(self, pages: Iterable[str]) -> Iterator[Dict]:
+        """Yield chunks as soon as enough sentences have arrived.
+
+        Each chunk is a dict with ``text``, ``start`` and ``end`` character
+        offsets into the non-empty pages joined by PAGE_SEPARATOR, and the
+        1-based ``page`` and ``page_end`` it spans.
+        """
+        # Buffered sentences: dicts with text, start, end, page, tokens and the
+        # original text (whitespace, page separators) that precedes them
+        buffer = []
+        buffer_tokens = 0
+        offset = 0
+        first_page = True
+        gap_parts = []
+
+        for page_number, page_text in enumerate(pages, 1):
+            if not page_text:
+                continue
+
+            if not first_page:
+                offset += len(PAGE_SEPARATOR)
+                gap_parts.append(PAGE_SEPARATOR)
+            first_page = False
+            cursor = 0
+
+            for start, end, new_paragraph in self._split_units(page_text):
+                unit_text = page_text[start:end]
+                unit = {
+                    'text': unit_text,
+                    'gap': "".join(gap_parts) + page_text[cursor:start],
+                    'start': offset + start,
+                    'end': offset + end,
+                    'page': page_number,
+                    'tokens': estimate_tokens(unit_text),
+                }
+                gap_parts = []
+                cursor = end
+
+                for piece in self._split_long(unit):
+                    # Close the chunk early at a paragraph break once it is mostly full
+                    full = buffer_tokens + piece['tokens'] > self.chunk_tokens
+                    paragraph_break = new_paragraph and buffer_tokens >= self.chunk_tokens * 0.75
+                    if buffer and (full or paragraph_break):
+                        yield self._make_chunk(buffer)
+                        buffer = self._overlap(buffer)
+                        buffer_tokens = sum(item['tokens'] for item in buffer)
+                    buffer.append(piece)
+                    buffer_tokens += piece['tokens']
+                    new_paragraph = False
+
+            gap_parts.append(page_text[cursor:])
+            offset += len(page_text)
+
+        if buffer:
+            yield self._make_chunk(buffer)
+
+    def chunk_text(self, text: str) -> List[Dict]:
+        """Chunk a single block of text (treated as one page)"""
+        return list(self.chunk_pages([text]))
+
+    def _split_units(self, text: str) -> Iterator[tuple]:
+        """Yield (start, end, starts_paragraph) spans of sentences, trimmed of whitespace"""
+        position = 0
+        new_paragraph = True
+
+        for match in _BOUNDARY_RE.finditer(text):
+            # Keep closing quotes/brackets with the sentence they end
+            boundary = match.start() + len(match.group(0)) - len(match.group(0).lstrip('"\')]'))
+            span = self._trim(text, position, boundary)
+            if span:
+                yield span[0], span[1], new_paragraph
+                new_paragraph = False
+            if _PARAGRAPH_RE.search(match.group(0)):
+                new_paragraph = True
+            position = match.end()
+
+        span = self._trim(text, position, len(text))
+        if span:
+            yield span[0], span[1], new_paragraph
+
+    def _trim(self, text: str, start: int, end: int):
+        """Shrink a span to exclude surrounding whitespace, or None if it is blank"""
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        return (start, end) if start < end else None
+
+    def _split_long(self, unit: Dict) -> Iterator[Dict]:
+        """Break a sentence longer than a whole chunk at word boundaries"""
+        if unit['tokens'] <= self.chunk_tokens:
+            yield unit
+            return
+
+        text = unit['text']
+        max_chars = self.chunk_tokens * 4
+        position = 0
+        gap = unit['gap']
+
+        while position < len(text):
+            end = min(position + max_chars, len(text))
+            if end < len(text):
+                space = max(text.rfind(" ", position + 1, end), text.rfind("\n", position + 1, end))
+                if space > position:
+                    end = space
+
+            piece_text = text[position:end]
+            yield {
+                'text': piece_text,
+                'gap': gap,
+                'start': unit['start'] + position,
+                'end': unit['start'] + end,
+                'page': unit['page'],
+                'tokens': estimate_tokens(piece_text),
+            }
+
+            # Skip the whitespace between pieces; it becomes the next piece's gap
+            next_position = end
+            while next_position < len(text) and text[next_position].isspace():
+                next_position += 1
+            gap = text[end:next_position]
+            position = next_position
+
+    def _overlap(self, buffer: List[Dict]) -> List[Dict]:
+        """Trailing sentences of a finished chunk to repeat at the start of the next"""
+        kept = []
+        tokens = 0
+        for item in reversed(buffer):
+            if tokens + item['tokens'] > self.overlap_tokens:
+                break
+            kept.insert(0, item)
+            tokens += item['tokens']
+        return kept
+
+    def _make_chunk(self, buffer: List[Dict]) -> Dict:
+        """Join buffered sentences, restoring the original text between them"""
+        text = buffer[0]['text'] + "".join(item['gap'] + item['text'] for item in buffer[1:])
+        return {
+            'text': text,
+            'start': buffer[0]['start'],
+            'end': buffer[-1]['end'],
+            'page': buffer[0]['page'],
+            'page_end': buffer[-1]['page'],
+        }
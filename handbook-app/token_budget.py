@@ -0,0 +1,93 @@
+import os
+import re
+from typing import List, Dict, Callable, Optional
+
+import metrics
+from text_chunker import estimate_tokens
+
+# Rough output tokens per English word, for turning "2500+ words" into a token reservation
+TOKENS_PER_WORD = 1.35
+
+# A chunk is only trimmed to fit if at least this many tokens of it would remain
+MIN_TRIM_TOKENS = 64
+
+_WORD_TARGET_RE = re.compile(r'(\d[\d,]*)\+?\s*words', re.IGNORECASE)
+
+
+def output_tokens_for(instruction: str, default: int) -> int:
+    """Tokens to reserve for a response, from a word target in the instruction if it has one"""
+    match = _WORD_TARGET_RE.search(instruction)
+    if not match:
+        return default
+    return int(int(match.group(1).replace(",", "")) * TOKENS_PER_WORD)
+
+
+class TokenBudget:
+    def __init__(self, context_window: Optional[int] = None, max_context_tokens: Optional[int] = None,
+                 max_output_tokens: Optional[int] = None, safety_margin: float = 0.05):
+        """Splits each call's token allowance between instructions, context and expected output.
+
+        Context gets whatever the window leaves after the prompt template and
+        the output reservation, capped at ``max_context_tokens`` so requests
+        stay predictable in latency and cost. Counts use the local
+        ``estimate_tokens`` heuristic; ``safety_margin`` absorbs its error.
+        """
+        self.context_window = context_window or int(os.getenv('LLM_CONTEXT_WINDOW', '32768'))
+        self.max_context_tokens = max_context_tokens or int(os.getenv('MAX_CONTEXT_TOKENS', '12000'))
+        self.max_output_tokens = max_output_tokens or int(os.getenv('LLM_MAX_OUTPUT_TOKENS', '8192'))
+        self.safety_margin = safety_margin
+
+    def allocate(self, template: str, output_tokens: int) -> Dict[str, int]:
+        """Budget for one call whose prompt is ``template`` plus context.
+
+        Returns estimated tokens for the instructions, the output reservation
+        (capped at the model's output limit) and the context allowance.
+        """
+        instructions = estimate_tokens(template)
+        output = min(output_tokens, self.max_output_tokens)
+        usable = int(self.context_window * (1 - self.safety_margin))
+        context = max(0, min(self.max_context_tokens, usable - instructions - output))
+        return {'instructions': instructions, 'output': output, 'context': context}
+
+    def fit(self, contexts: List[Dict], budget: int,
+            render: Callable[[Dict], str] = lambda ctx: ctx['text']) -> List[Dict]:
+        """Keep contexts best-first while they fit in ``budget`` tokens.
+
+        The first context that does not fit is trimmed to the space left (when
+        enough remains to be useful) and everything ranked below it is
+        dropped. ``render`` gives the text a context takes up in the prompt,
+        citation label included.
+        """
+        kept = []
+        used = 0
+
+        for ctx in contexts:
+            tokens = estimate_tokens(render(ctx)) + 1
+            if used + tokens <= budget:
+                kept.append(ctx)
+                used += tokens
+                continue
+
+            overhead = tokens - estimate_tokens(ctx['text'])
+            room = budget - used - overhead
+            if room >= MIN_TRIM_TOKENS:
+                kept.append({**ctx, 'text': _trim(ctx['text'], room), 'trimmed': True})
+                metrics.inc('context_chunks_trimmed_total')
+
+            dropped = len(contexts) - len(kept)
+            if dropped:
+                metrics.inc('context_chunks_dropped_total', dropped)
+            break
+
+        return kept
+
+
+def _trim(text: str, tokens: int) -> str:
+    """Cut text to about ``tokens`` estimated tokens, at a sentence or word boundary"""
+    limit = max(0, tokens * 4 - 1)
+    cut = text[:limit]
+    sentence_end = max(cut.rfind(". "), cut.rfind(".\n"))
+    if sentence_end > limit // 2:
+        return cut[:sentence_end + 1]
+    space = cut.rfind(" ")
+    return (cut[:space] if space > 0 else cut) + " …"